@@ -0,0 +1,375 @@
+"""
+Columnar export of extracted payloads (documents.metadata.extracted) for bulk analytics.
+
+A store is a directory of raw little-endian column files plus manifest.json:
+
+- dates (pickup/delivery/invoice): int64 days since 1970-01-01 (numpy datetime64[D], NaT = missing)
+- created_at: int64 seconds since epoch (datetime64[s])
+- money, miles, rate_per_mile, weight: float64 (NaN = missing)
+- lanes, states, cities, brokers, equipment, ...: int32 codes into <column>.dict.json (-1 = missing)
+- document_id: fixed 36-byte ASCII (UUID)
+
+Writing needs only the standard library. Appends write column bytes first and
+publish the new row count in the manifest last, so a crashed append is rolled
+back (truncated) by the next one. load() memory-maps the columns with numpy, so
+a study over millions of rows touches only the columns and pages it reads.
+
+Usage:
+  python columnar_export.py export exports/extracted          # full rebuild from Supabase documents
+  python columnar_export.py append exports/extracted          # only documents created since the last run
+  python extract_invoice.py pdfs/ --jsonl | python columnar_export.py append exports/extracted --jsonl -
+  python columnar_export.py info exports/extracted
+
+  from columnar_export import categories, load
+  cols = load("exports/extracted", ["lane", "rate_per_mile"])   # {name: memory-mapped numpy array}
+  lanes = categories("exports/extracted", "lane")               # cols["lane"] holds codes into this list
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+from array import array
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+PAGE_SIZE = 1000
+NAT = -(2**63)
+ID_BYTES = 36
+_EPOCH = date(1970, 1, 1)
+
+# column -> kind; order is the on-disk column order
+COLUMNS = {
+    "document_id": "id",
+    "created_at": "timestamp",
+    "document_type": "category",
+    "user_id": "category",
+    "pickup_date": "date",
+    "delivery_date": "date",
+    "invoice_date": "date",
+    "origin_city": "category",
+    "origin_state": "category",
+    "origin_zip": "category",
+    "destination_city": "category",
+    "destination_state": "category",
+    "destination_zip": "category",
+    "lane": "category",
+    "total_rate": "float",
+    "amount_due": "float",
+    "line_haul": "float",
+    "detention": "float",
+    "lumper": "float",
+    "accessorials_other": "float",
+    "factoring_fee": "float",
+    "miles": "float",
+    "rate_per_mile": "float",
+    "weight": "float",
+    "equipment_type": "category",
+    "commodity": "category",
+    "broker_name": "category",
+    "client_name": "category",
+}
+# kind -> (array typecode for writing, numpy dtype for reading, item size)
+KINDS = {
+    "date": ("q", "<i8", 8),
+    "timestamp": ("q", "<i8", 8),
+    "float": ("d", "<f8", 8),
+    "category": ("i", "<i4", 4),
+    "id": (None, f"S{ID_BYTES}", ID_BYTES),
+}
+_NUMPY_VIEW = {"date": "datetime64[D]", "timestamp": "datetime64[s]"}
+
+
+# --- Value conversion: extracted payload -> typed column values ---
+def _to_date(v) -> int:
+    try:
+        return (date.fromisoformat(str(v)[:10]) - _EPOCH).days if v else NAT
+    except ValueError:
+        return NAT
+
+
+def _to_timestamp(v) -> int:
+    if not v:
+        return NAT
+    try:
+        dt = datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    except ValueError:
+        return NAT
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _to_float(v) -> float:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return math.nan
+    return f if math.isfinite(f) else math.nan
+
+
+def _to_label(v) -> str | None:
+    s = " ".join(str(v).split()) if v is not None else ""
+    return s or None
+
+
+def row_from_extracted(document_id: str, extracted: dict, created_at=None, document_type=None, user_id=None) -> dict:
+    """Flatten one extracted payload into {column: python value} (labels as str, dates as ISO strings)."""
+    e = extracted or {}
+    origin, dest = _to_label(e.get("origin_state")), _to_label(e.get("destination_state"))
+    row = {name: e.get(name) for name in COLUMNS}
+    row.update({
+        "document_id": str(document_id),
+        "created_at": created_at,
+        "document_type": document_type,
+        "user_id": user_id,
+        "lane": f"{origin}-{dest}" if origin and dest else None,
+        "accessorials_other": (e.get("accessorials") or {}).get("other"),
+    })
+    return row
+
+
+def _locked(store: Path):
+    """Exclusive lock on the store for one append or reset; released when the returned file is closed."""
+    lock = open(store / ".lock", "a+")
+    if os.name == "nt":
+        import msvcrt
+
+        lock.seek(0)
+        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+class ColumnStore:
+    """Append-only column files under one directory; see the module docstring for the layout."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+
+    def manifest(self) -> dict:
+        try:
+            return json.loads((self.path / MANIFEST).read_text())
+        except FileNotFoundError:
+            return {
+                "version": FORMAT_VERSION,
+                "rows": 0,
+                "columns": {name: {"kind": kind, "dtype": KINDS[kind][1]} for name, kind in COLUMNS.items()},
+                "cursor": None,
+            }
+
+    def _write_json(self, filename: str, data) -> None:
+        # Atomic replace: readers never see a half-written manifest or dictionary
+        tmp = self.path / f"{filename}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps(data, ensure_ascii=False))
+        os.replace(tmp, self.path / filename)
+
+    def _dictionary(self, name: str) -> list[str]:
+        try:
+            return json.loads((self.path / f"{name}.dict.json").read_text())
+        except FileNotFoundError:
+            return []
+
+    def document_ids(self) -> set[str]:
+        rows = self.manifest()["rows"]
+        with open(self.path / "document_id.bin", "rb") as f:
+            data = f.read(rows * ID_BYTES) if rows else b""
+        return {data[i : i + ID_BYTES].rstrip(b"\0").decode("ascii") for i in range(0, len(data), ID_BYTES)}
+
+    def append(self, rows: list[dict], cursor: dict | None = None, seen: set[str] | None = None) -> int:
+        """Append rows from row_from_extracted() (skipping document_ids already stored); returns rows written.
+        cursor, if given, is saved in the manifest for the next incremental Supabase export.
+        seen: document_ids already in the store, kept up to date by this call; pass the same set to a series
+        of appends so the id column is read once per run instead of once per append."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        lock = _locked(self.path)
+        try:
+            manifest = self.manifest()
+            n = manifest["rows"]
+            if seen is None:
+                seen = self.document_ids() if n else set()
+            fresh = []
+            for row in rows:
+                if row["document_id"] not in seen and len(row["document_id"].encode("ascii", "replace")) <= ID_BYTES:
+                    seen.add(row["document_id"])
+                    fresh.append(row)
+            for name, kind in COLUMNS.items():
+                typecode, _dtype, size = KINDS[kind]
+                if kind == "id":
+                    data = b"".join(r[name].encode("ascii", "replace").ljust(ID_BYTES, b"\0") for r in fresh)
+                elif kind == "category":
+                    labels = self._dictionary(name)
+                    codes = {label: i for i, label in enumerate(labels)}
+                    values = array(typecode)
+                    for r in fresh:
+                        label = _to_label(r.get(name))
+                        if label is not None and label not in codes:
+                            codes[label] = len(labels)
+                            labels.append(label)
+                        values.append(codes[label] if label is not None else -1)
+                    self._write_json(f"{name}.dict.json", labels)
+                    data = values
+                else:
+                    convert = {"date": _to_date, "timestamp": _to_timestamp, "float": _to_float}[kind]
+                    data = array(typecode, (convert(r.get(name)) for r in fresh))
+                if isinstance(data, array) and sys.byteorder != "little":
+                    data.byteswap()
+                with open(self.path / f"{name}.bin", "ab") as f:
+                    # Drop bytes left by an append that crashed before publishing its manifest
+                    f.truncate(n * size)
+                    f.write(data.tobytes() if isinstance(data, array) else data)
+                    f.flush()
+                    os.fsync(f.fileno())
+            manifest["rows"] = n + len(fresh)
+            if cursor is not None:
+                manifest["cursor"] = cursor
+            manifest["updated_at"] = datetime.now(timezone.utc).isoformat()
+            self._write_json(MANIFEST, manifest)
+            return len(fresh)
+        finally:
+            lock.close()
+
+    def reset(self) -> None:
+        """Remove the store's files (manifest, columns, dictionaries); nothing else in the directory."""
+        if not self.path.is_dir():
+            return
+        # Same lock as append(), so a concurrent append never interleaves with the deletion
+        lock = _locked(self.path)
+        try:
+            for name in COLUMNS:
+                (self.path / f"{name}.bin").unlink(missing_ok=True)
+                (self.path / f"{name}.dict.json").unlink(missing_ok=True)
+            (self.path / MANIFEST).unlink(missing_ok=True)
+        finally:
+            lock.close()
+
+    def info(self) -> dict:
+        manifest = self.manifest()
+        sizes = {name: (self.path / f"{name}.bin").stat().st_size for name in COLUMNS if (self.path / f"{name}.bin").exists()}
+        return {
+            "path": str(self.path),
+            "rows": manifest["rows"],
+            "cursor": manifest.get("cursor"),
+            "updated_at": manifest.get("updated_at"),
+            "bytes": sum(sizes.values()),
+            "categories": {name: len(self._dictionary(name)) for name, kind in COLUMNS.items() if kind == "category"},
+        }
+
+
+# --- Reading (requires numpy) ---
+def categories(path: str | Path, name: str) -> list[str]:
+    """Labels of a category column: code i in load()[name] is categories(path, name)[i]."""
+    return ColumnStore(path)._dictionary(name)
+
+
+def load(path: str | Path, columns: list[str] | None = None, mmap: bool = True) -> dict:
+    """Columns as numpy arrays, memory-mapped read-only by default. Category columns are int32 codes
+    (-1 = missing; see categories()); dates are datetime64[D], created_at datetime64[s]."""
+    import numpy as np
+
+    store = ColumnStore(path)
+    manifest = store.manifest()
+    rows = manifest["rows"]
+    out = {}
+    for name in columns or list(manifest["columns"]):
+        spec = manifest["columns"][name]
+        file = store.path / f"{name}.bin"
+        if rows == 0:
+            arr = np.empty(0, dtype=spec["dtype"])
+        elif mmap:
+            arr = np.memmap(file, dtype=spec["dtype"], mode="r", shape=(rows,))
+        else:
+            arr = np.fromfile(file, dtype=spec["dtype"], count=rows)
+        if spec["kind"] in _NUMPY_VIEW:
+            arr = arr.view(_NUMPY_VIEW[spec["kind"]])
+        out[name] = arr
+    return out
+
+
+# --- Sources: Supabase documents (incremental by created_at, id) or extract_invoice.py --jsonl output ---
+def fetch_documents(sb, cursor: dict | None):
+    """Yield (rows, cursor) pages of documents created after cursor, oldest first."""
+    while True:
+        q = sb.table("documents").select(
+            "id, created_at, document_type, extracted:metadata->extracted, user_id:metadata->>user_id"
+        )
+        if cursor:
+            ts, last_id = cursor["created_at"], cursor["id"]
+            q = q.or_(f'created_at.gt."{ts}",and(created_at.eq."{ts}",id.gt.{last_id})')
+        r = q.order("created_at").order("id").limit(PAGE_SIZE).execute()
+        docs = r.data or []
+        if not docs:
+            return
+        rows = [
+            row_from_extracted(d["id"], d.get("extracted") or {}, d.get("created_at"), d.get("document_type"), d.get("user_id"))
+            for d in docs
+            if d.get("extracted")
+        ]
+        cursor = {"created_at": docs[-1]["created_at"], "id": docs[-1]["id"]}
+        yield rows, cursor
+        if len(docs) < PAGE_SIZE:
+            return
+
+
+def rows_from_jsonl(lines, document_type: str | None = None, user_id: str | None = None):
+    """Rows from extract_invoice.py --jsonl result records (new documents only; duplicates and errors skipped).
+    created_at is the record's documents.created_at; records from older extractors without it get NaT."""
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec.get("type", "result") != "result" or rec.get("error") or rec.get("duplicate"):
+            continue
+        if rec.get("document_id") and rec.get("extracted"):
+            yield row_from_extracted(rec["document_id"], rec["extracted"], rec.get("created_at"), document_type, user_id)
+
+
+def export_from_supabase(store: ColumnStore, sb) -> int:
+    written = 0
+    seen = store.document_ids() if store.manifest()["rows"] else set()
+    for rows, cursor in fetch_documents(sb, store.manifest().get("cursor")):
+        written += store.append(rows, cursor=cursor, seen=seen)
+    return written
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Export extracted invoice fields to memory-mappable column files")
+    ap.add_argument("command", choices=["export", "append", "info"], help="export: rebuild from scratch; append: add new documents; info: summary")
+    ap.add_argument("path", help="Store directory, e.g. exports/extracted")
+    ap.add_argument("--jsonl", metavar="FILE", help="Append from extract_invoice.py --jsonl output (FILE or - for stdin) instead of Supabase")
+    ap.add_argument("--document-type", default=None, help="document_type to record for --jsonl rows")
+    ap.add_argument("--user-id", dest="user_id", default=None, help="user_id to record for --jsonl rows")
+    args = ap.parse_args()
+
+    store = ColumnStore(args.path)
+    if args.command == "info":
+        print(json.dumps(store.info(), ensure_ascii=False))
+        return
+    if args.command == "export":
+        store.reset()
+    if args.jsonl:
+        f = sys.stdin if args.jsonl == "-" else open(args.jsonl, encoding="utf-8")
+        try:
+            written = store.append(list(rows_from_jsonl(f, args.document_type, args.user_id)))
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    else:
+        from extract_invoice import get_supabase
+
+        written = export_from_supabase(store, get_supabase())
+    print(json.dumps({"written": written, **store.info()}, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
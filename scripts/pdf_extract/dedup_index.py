@@ -0,0 +1,304 @@
+"""
+Near-duplicate detection for uploaded PDFs.
+
+Each page is rendered at low resolution and reduced to a 64-bit difference hash
+(dHash). Hashes are stored in a local SQLite file and searched there by
+multi-index hashing: each hash is split into four indexed 16-bit bands, and any
+hash within Hamming distance d of the query agrees with it to within d // 4 bits
+in at least one band. A lookup enumerates those few band values per band, lets
+SQLite's indexes return the candidates for the current user and checks the full
+distance in Python. Nothing is loaded up front, so the one-process-per-upload
+extractor pays per lookup, not per stored hash. A phone photo, re-scan or
+merged PDF of an invoice we already processed is thus found before the full
+OCR/LLM/geocoding pipeline runs.
+
+Page hashes alone cannot tell two invoices printed from the same template apart,
+so a page match is only a candidate: it is confirmed by a fingerprint of the fields
+parsed from the first page, which is the only page OCR'd for a duplicate. A
+fingerprint of the full extracted payload catches the remaining duplicates whose
+pixels differ too much (different crop, heavy skew).
+
+Env: EXTRACT_DEDUP_DB (SQLite path, default state/dedup_index.sqlite next to this file),
+     EXTRACT_DEDUP_MAX_DISTANCE (Hamming distance for a page match, default 10).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+HASH_DPI = 36
+DEFAULT_MAX_DISTANCE = 10
+# Near-blank pages (separator sheets, empty backs) hash to almost all zeros and would match each other.
+MIN_HASH_BITS = 8
+# Fields that identify one load on one invoice; see fields_fingerprint().
+FINGERPRINT_FIELDS = (
+    "pickup_date",
+    "delivery_date",
+    "invoice_date",
+    "origin_city",
+    "origin_state",
+    "origin_zip",
+    "destination_city",
+    "destination_state",
+    "destination_zip",
+    "total_rate",
+    "amount_due",
+    "line_haul",
+    "truck_number",
+)
+
+
+def default_db_path() -> Path:
+    env = os.environ.get("EXTRACT_DEDUP_DB")
+    if env:
+        return Path(env)
+    return Path(__file__).resolve().parent / "state" / "dedup_index.sqlite"
+
+
+# --- Perceptual hashing ---
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: one bit per horizontally adjacent pixel pair of a (size+1) x size grayscale thumbnail."""
+    small = img.convert("L").resize((size + 1, size), Image.LANCZOS)
+    px = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def pdf_page_hashes(pdf_path: str, dpi: int = HASH_DPI) -> list[int]:
+    """Render every page at low DPI and return one dHash per page (cheap compared to OCR)."""
+    doc = fitz.open(pdf_path)
+    hashes = []
+    try:
+        for i in range(len(doc)):
+            pix = doc.load_page(i).get_pixmap(dpi=dpi, alpha=False)
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            hashes.append(dhash(img))
+    finally:
+        doc.close()
+    return hashes
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+BANDS = 4
+BAND_BITS = 16
+_BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def hash_bands(value: int) -> list[int]:
+    """Split a 64-bit hash into BANDS 16-bit integers (most significant first)."""
+    return [(value >> (BAND_BITS * (BANDS - 1 - i))) & _BAND_MASK for i in range(BANDS)]
+
+
+def _band_neighbors(band: int, radius: int) -> list[int]:
+    """Every 16-bit value within `radius` flipped bits of band (radius 2 -> 137 values)."""
+    out = [band]
+    frontier = [(band, -1)]
+    for _ in range(radius):
+        nxt = []
+        for value, last in frontier:
+            for bit in range(last + 1, BAND_BITS):
+                flipped = value ^ (1 << bit)
+                out.append(flipped)
+                nxt.append((flipped, bit))
+        frontier = nxt
+    return out
+
+
+# --- Extracted-field fingerprint ---
+def fields_fingerprint(extracted: dict | None) -> str | None:
+    """SHA-1 of the normalized lane/date/amount fields, or None when too little was parsed to identify a load."""
+    if not extracted:
+        return None
+    values = {}
+    for key in FINGERPRINT_FIELDS:
+        v = extracted.get(key)
+        if isinstance(v, str):
+            v = " ".join(v.split()).upper() or None
+        elif isinstance(v, (int, float)):
+            v = round(float(v), 2)
+        values[key] = v
+    has_amount = any(values[k] is not None for k in ("total_rate", "amount_due", "line_haul"))
+    has_lane_or_date = any(
+        values[k] is not None for k in ("origin_city", "destination_city", "pickup_date", "delivery_date", "invoice_date")
+    )
+    if not (has_amount and has_lane_or_date):
+        return None
+    blob = json.dumps(values, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+# --- Persistent index ---
+class DedupIndex:
+    """SQLite-backed store of processed documents, their page hashes and field fingerprints."""
+
+    def __init__(self, db_path: str | Path | None = None, max_distance: int | None = None):
+        self.db_path = Path(db_path) if db_path else default_db_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        if max_distance is None:
+            max_distance = int(os.environ.get("EXTRACT_DEDUP_MAX_DISTANCE", DEFAULT_MAX_DISTANCE))
+        self.max_distance = max_distance
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS dedup_documents (
+              document_id TEXT PRIMARY KEY,
+              user_id TEXT,
+              fingerprint TEXT,
+              first_page_fingerprint TEXT,
+              extracted TEXT,
+              created_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_dedup_documents_fingerprint ON dedup_documents(fingerprint, user_id);
+            CREATE TABLE IF NOT EXISTS dedup_page_hashes (
+              document_id TEXT NOT NULL REFERENCES dedup_documents(document_id) ON DELETE CASCADE,
+              page INTEGER NOT NULL,
+              hash TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_dedup_page_hashes_document ON dedup_page_hashes(document_id);
+            """
+        )
+        self._migrate_bands()
+
+    def _migrate_bands(self) -> None:
+        """Add the per-user band columns/indexes (and backfill them for indexes written before they existed)."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(dedup_page_hashes)")}
+        with self._conn:
+            if "b0" not in columns:
+                self._conn.execute("ALTER TABLE dedup_page_hashes ADD COLUMN user_id TEXT")
+                for i in range(BANDS):
+                    self._conn.execute(f"ALTER TABLE dedup_page_hashes ADD COLUMN b{i} INTEGER")
+                rows = self._conn.execute(
+                    "SELECT p.rowid, d.user_id, p.hash FROM dedup_page_hashes p "
+                    "JOIN dedup_documents d ON d.document_id = p.document_id"
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE dedup_page_hashes SET user_id = ?, b0 = ?, b1 = ?, b2 = ?, b3 = ? WHERE rowid = ?",
+                    [(user_id, *hash_bands(int(h, 16)), rowid) for rowid, user_id, h in rows],
+                )
+            for i in range(BANDS):
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS idx_dedup_page_hashes_b{i} ON dedup_page_hashes(user_id, b{i})"
+                )
+
+    def _search(self, value: int, user_id: str | None) -> dict[str, int]:
+        """document_id -> smallest Hamming distance of any of its pages to value, within max_distance."""
+        radius = self.max_distance // BANDS
+        best = {}
+        for i, band in enumerate(hash_bands(value)):
+            neighbors = _band_neighbors(band, radius)
+            marks = ",".join("?" * len(neighbors))
+            for document_id, h in self._conn.execute(
+                f"SELECT document_id, hash FROM dedup_page_hashes WHERE user_id IS ? AND b{i} IN ({marks})",
+                (user_id, *neighbors),
+            ):
+                d = hamming(value, int(h, 16))
+                if d <= self.max_distance and d < best.get(document_id, d + 1):
+                    best[document_id] = d
+        return best
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _document(self, document_id: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT document_id, extracted FROM dedup_documents WHERE document_id = ?", (document_id,)
+        ).fetchone()
+        if not row:
+            return None
+        return {"document_id": row[0], "extracted": json.loads(row[1]) if row[1] else None}
+
+    def page_candidates(self, hashes: list[int], user_id: str | None) -> list[str]:
+        """Return document_ids whose pages look like this upload, best first.
+
+        The first page of the upload (the invoice page on merged PDFs) must match; candidates are
+        ranked by number of matched pages, then by total distance."""
+        if not hashes or hashes[0].bit_count() < MIN_HASH_BITS:
+            return []
+        candidates = {}  # document_id -> [matched_pages, total_distance, first_page_matched]
+        for i, h in enumerate(hashes):
+            if h.bit_count() < MIN_HASH_BITS:
+                continue
+            for document_id, d in self._search(h, user_id).items():
+                c = candidates.setdefault(document_id, [0, 0, False])
+                c[0] += 1
+                c[1] += d
+                if i == 0:
+                    c[2] = True
+        ranked = sorted((-c[0], c[1], document_id) for document_id, c in candidates.items() if c[2])
+        return [document_id for _, _, document_id in ranked]
+
+    def confirm(self, candidates: list[str], first_page_fingerprint: str | None) -> dict | None:
+        """Return the first candidate whose first page parsed to the same fields, or None."""
+        if not candidates or not first_page_fingerprint:
+            return None
+        for document_id in candidates:
+            row = self._conn.execute(
+                "SELECT 1 FROM dedup_documents WHERE document_id = ? AND first_page_fingerprint = ?",
+                (document_id, first_page_fingerprint),
+            ).fetchone()
+            if row:
+                return self._document(document_id)
+        return None
+
+    def find_by_fingerprint(self, fingerprint: str | None, user_id: str | None) -> dict | None:
+        if not fingerprint:
+            return None
+        row = self._conn.execute(
+            "SELECT document_id FROM dedup_documents WHERE fingerprint = ? AND user_id IS ? ORDER BY created_at LIMIT 1",
+            (fingerprint, user_id),
+        ).fetchone()
+        return self._document(row[0]) if row else None
+
+    def remove(self, document_id: str) -> None:
+        """Forget a document (e.g. deleted from Supabase) and its page hashes."""
+        with self._conn:
+            self._conn.execute("DELETE FROM dedup_page_hashes WHERE document_id = ?", (str(document_id),))
+            self._conn.execute("DELETE FROM dedup_documents WHERE document_id = ?", (str(document_id),))
+
+    def add(
+        self,
+        document_id: str,
+        user_id: str | None,
+        hashes: list[int],
+        fingerprint: str | None = None,
+        first_page_fingerprint: str | None = None,
+        extracted: dict | None = None,
+    ) -> None:
+        """Record a processed document (or another rendition of one) so later uploads can match it."""
+        document_id = str(document_id)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO dedup_documents "
+                "(document_id, user_id, fingerprint, first_page_fingerprint, extracted, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    document_id,
+                    user_id,
+                    fingerprint,
+                    first_page_fingerprint,
+                    json.dumps(extracted, ensure_ascii=False, default=str) if extracted is not None else None,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+            start = self._conn.execute(
+                "SELECT COALESCE(MAX(page) + 1, 0) FROM dedup_page_hashes WHERE document_id = ?", (document_id,)
+            ).fetchone()[0]
+            rows = [(document_id, start + i, f"{h:016x}", user_id, *hash_bands(h)) for i, h in enumerate(hashes)]
+            self._conn.executemany(
+                "INSERT INTO dedup_page_hashes (document_id, page, hash, user_id, b0, b1, b2, b3) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
@@ -9,19 +9,29 @@ financials (total rate, line haul, accessorials, factoring), load specs
 Usage:
   python extract_invoice.py path/to/file.pdf --user-id "<supabase-auth-uid>"
   python extract_invoice.py path/to/folder/ --user-id "<uid>"
+  python extract_invoice.py path/to/folder/ --user-id "<uid>" --jsonl   # stream one JSON line per document
+  python extract_invoice.py file.pdf --incremental-ocr && python extract_invoice.py --complete-ocr
+  python extract_invoice.py path/to/folder/ --user-id "<uid>" --enqueue   # backfill pool; a single file goes to interactive
+  python extract_invoice.py --worker --concurrency 4                      # claim and process queued jobs
+  python extract_invoice.py --queue-stats
 
 Env: SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY (or SUPABASE_ANON_KEY),
      optional NEXT_PUBLIC_SUPABASE_URL / NEXT_PUBLIC_SUPABASE_ANON_KEY.
      Optional EXTRACT_USE_LLM=1 and OPENAI_API_KEY for LLM fallback parsing.
+     Optional EXTRACT_DEDUP=0 to disable near-duplicate detection (see dedup_index.py).
 """
 
 import argparse
 import json
 import os
 import re
+import shutil
+import socket
 import sys
+import threading
 import time
-from datetime import datetime, timezone
+import uuid
+from datetime import date, datetime, timezone
 from pathlib import Path
 
 # Load env before other imports that use it
@@ -41,26 +51,32 @@ import pytesseract
 from PIL import Image
 import supabase
 
+from dedup_index import DedupIndex, fields_fingerprint, pdf_page_hashes
+from gazetteer import get_gazetteer
+from http_client import Budget, default_client
+from job_queue import DEFAULT_VISIBILITY_TIMEOUT_S, POOLS, JobQueue, is_transient_error
+from lane_aggregates import LaneAggregates
+
 
 # --- OCR: PDF pages -> raw text ---
+def render_page(doc, i: int) -> Image.Image:
+    pix = doc.load_page(i).get_pixmap(dpi=150, alpha=False)
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
 def pdf_to_images(pdf_path: str) -> list[Image.Image]:
     doc = fitz.open(pdf_path)
-    images = []
-    for i in range(len(doc)):
-        page = doc.load_page(i)
-        pix = page.get_pixmap(dpi=150, alpha=False)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        images.append(img)
+    images = [render_page(doc, i) for i in range(len(doc))]
     doc.close()
     return images
 
 
+def ocr_pages(images: list[Image.Image]) -> list[str]:
+    return [pytesseract.image_to_string(img, config="--psm 6") for img in images]
+
+
 def ocr_images(images: list[Image.Image]) -> str:
-    blocks = []
-    for img in images:
-        text = pytesseract.image_to_string(img, config="--psm 6")
-        blocks.append(text)
-    return "\n\n".join(blocks)
+    return "\n\n".join(ocr_pages(images))
 
 
 # --- Regex-based extraction (works without API) ---
@@ -147,6 +163,27 @@ def _re_money(s: str) -> list[tuple[str, float]]:
     return results
 
 
+# "CITY ST 12345" with up to 3 more words before the city on the same line (multi-word cities, street/company words).
+# The state may carry an OCR digit (0H, 1L) as long as one letter survives; Gazetteer.fix_state repairs it.
+_ADDR_RE = re.compile(r"\b((?:\w+[ \t]+){0,3}\w+)\s+([A-Z][A-Z0-9]|[0-9][A-Z])\s+(\d{5}(?:-\d{4})?)\b")
+
+
+def _addr_fields(m: re.Match) -> tuple[str, str, str]:
+    """(city, state, zip) from an _ADDR_RE match, with the state repaired when the gazetteer knows it."""
+    gz = get_gazetteer()
+    state = (gz.fix_state(m.group(2)) if gz else None) or m.group(2).upper()[:2]
+    return _pick_city(m.group(1), state), state, m.group(3)
+
+
+def _pick_city(words: str, state: str) -> str:
+    """City from the words before "ST ZIP": longest suffix the gazetteer knows (fuzzy for OCR noise), else the last word."""
+    tokens = words.upper().split()
+    gz = get_gazetteer()
+    st = gz.fix_state(state) if gz else None
+    city = gz.city_from_words(tokens, st) if st else None
+    return (city or tokens[-1])[:100]
+
+
 def _re_pu_so_blocks(s: str) -> dict:
     """Extract origin from PU/pickup block and destination from SO/delivery block.
     PU 1 / PU / Pickup = starting point (origin); get pickup_date and origin city/state/zip from that block.
@@ -171,12 +208,10 @@ def _re_pu_so_blocks(s: str) -> dict:
         start = pu_match.end()
         end = so_match.start() if (so_match and so_match.start() > pu_match.start()) else len(raw)
         pu_block = raw[start:end]
-        addr_m = list(re.finditer(r"\b(\w+)\s+([A-Z]{2})\s+(\d{5}(?:-\d{4})?)\b", pu_block))
+        addr_m = list(_ADDR_RE.finditer(pu_block))
         if addr_m:
             m = addr_m[-1]
-            out["origin_city"] = m.group(1).strip().upper()[:100]
-            out["origin_state"] = m.group(2).upper()[:2]
-            out["origin_zip"] = m.group(3)
+            out["origin_city"], out["origin_state"], out["origin_zip"] = _addr_fields(m)
         date_m = re.search(r"(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})", pu_block)
         if date_m:
             mm, dd, yy = date_m.group(1), date_m.group(2), date_m.group(3)
@@ -187,12 +222,10 @@ def _re_pu_so_blocks(s: str) -> dict:
         next_pu = pu_pattern.search(raw, start)
         end = next_pu.start() if (next_pu and next_pu.start() > start) else len(raw)
         so_block = raw[start:end]
-        addr_m = list(re.finditer(r"\b(\w+)\s+([A-Z]{2})\s+(\d{5}(?:-\d{4})?)\b", so_block))
+        addr_m = list(_ADDR_RE.finditer(so_block))
         if addr_m:
             m = addr_m[-1]
-            out["destination_city"] = m.group(1).strip().upper()[:100]
-            out["destination_state"] = m.group(2).upper()[:2]
-            out["destination_zip"] = m.group(3)
+            out["destination_city"], out["destination_state"], out["destination_zip"] = _addr_fields(m)
         date_m = re.search(r"(\d{1,2})[/\-](\d{1,2})[/\-](\d{2,4})", so_block)
         if date_m:
             mm, dd, yy = date_m.group(1), date_m.group(2), date_m.group(3)
@@ -367,6 +400,8 @@ def extract_structured(raw_text: str) -> dict:
         payload["destination_state"] = dest.get("state")
         payload["destination_zip"] = dest.get("zip")
 
+    _normalize_places(payload)
+
     for key, amount in _re_money(raw_text):
         if key == "total_rate":
             payload["total_rate"] = amount
@@ -408,6 +443,23 @@ def extract_structured(raw_text: str) -> dict:
     return payload
 
 
+def _normalize_places(payload: dict) -> None:
+    """Correct and complete origin/destination city/state/zip against the offline gazetteer (no network)."""
+    gz = get_gazetteer()
+    if gz is None:
+        return
+    for prefix in ("origin", "destination"):
+        city, state, zip_code = payload[f"{prefix}_city"], payload[f"{prefix}_state"], payload[f"{prefix}_zip"]
+        if not (city or state or zip_code):
+            continue
+        place = gz.resolve(city, state, zip_code)
+        if place:
+            payload[f"{prefix}_city"] = place["city"]
+            payload[f"{prefix}_state"] = place["state"]
+            # resolve() drops a zip that contradicts the city/state; do not put it back
+            payload[f"{prefix}_zip"] = place["zip"]
+
+
 def _normalize_date(s: str) -> str | None:
     """Try to return YYYY-MM-DD."""
     if not s:
@@ -422,6 +474,105 @@ def _normalize_date(s: str) -> str | None:
     return s
 
 
+# --- Completeness / consistency of the regex payload (decides whether the LLM is needed) ---
+# Required fields per document_type; a tuple is satisfied by any one of its fields.
+# broker_name is required where a rates row is written: process_pdf only inserts one when a company exists.
+REQUIRED_FIELDS = {
+    "invoice": ("pickup_date", "origin_city", "origin_state", "destination_city", "destination_state", COST_FIELDS_BASE, "broker_name"),
+    "bol": ("pickup_date", "origin_city", "origin_state", "destination_city", "destination_state", "commodity", "weight"),
+    "rate_sheet": ("origin_city", "origin_state", "destination_city", "destination_state", COST_FIELDS_BASE, "broker_name"),
+    "contract": ("origin_state", "destination_state"),
+    "other": ("origin_state", "destination_state"),
+}
+# Cap for a plausible $/mile; anything above is almost always a total misread as per-mile (or vice versa)
+MAX_RATE_PER_MILE = 20.0
+
+
+DATE_FIELDS = ("pickup_date", "delivery_date", "invoice_date")
+
+
+def _is_iso_date(value) -> bool:
+    """True for a real calendar date in YYYY-MM-DD form (what _normalize_date produces when it succeeds)."""
+    if not isinstance(value, str) or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        return False
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def assess_extraction(payload: dict, document_type: str = "invoice") -> dict:
+    """Score the parsed payload: {score 0..1, missing, issues, llm_fields}.
+    llm_fields are the keys worth asking the LLM for: missing required fields plus fields involved in an inconsistency."""
+    required = REQUIRED_FIELDS.get(document_type, REQUIRED_FIELDS["other"])
+    missing = []
+    unmet = 0
+    for req in required:
+        group = req if isinstance(req, tuple) else (req,)
+        if all(payload.get(k) in (None, "") for k in group):
+            missing.extend(group)
+            unmet += 1
+    issues = []
+    suspect = []
+    total, line_haul = payload.get("total_rate"), payload.get("line_haul")
+    if total is not None and line_haul is not None and total < line_haul:
+        issues.append("total_rate < line_haul")
+        suspect += ["total_rate", "line_haul"]
+    for key in DATE_FIELDS:
+        if payload.get(key) not in (None, "") and not _is_iso_date(payload[key]):
+            issues.append(f"{key} unparsable")
+            suspect.append(key)
+    pickup, delivery, invoice = (payload.get(k) if _is_iso_date(payload.get(k)) else None for k in DATE_FIELDS)
+    if pickup and delivery and delivery < pickup:
+        issues.append("delivery_date before pickup_date")
+        suspect += ["pickup_date", "delivery_date"]
+    if pickup and invoice and invoice < pickup:
+        issues.append("invoice_date before pickup_date")
+        suspect += ["pickup_date", "invoice_date"]
+    rpm = payload.get("rate_per_mile")
+    if rpm is not None and rpm > MAX_RATE_PER_MILE:
+        issues.append("rate_per_mile implausible")
+        suspect.append("rate_per_mile")
+    score = max((len(required) - unmet) / len(required) - 0.25 * len(issues), 0.0)
+    llm_fields = list(dict.fromkeys(missing + suspect))
+    return {"score": round(score, 2), "missing": missing, "issues": issues, "llm_fields": llm_fields}
+
+
+def merge_llm_fields(payload: dict, llm: dict, fields: list[str]) -> list[str]:
+    """Fill/override only the requested fields from the LLM result; returns the keys that changed."""
+    changed = []
+    for key in fields:
+        value = llm.get(key)
+        if value in (None, ""):
+            continue
+        if key.endswith("_date"):
+            value = _normalize_date(str(value))
+            if not _is_iso_date(value):
+                continue
+        elif key in COST_FIELDS_BASE + ("rate_per_mile", "detention", "lumper", "factoring_fee"):
+            try:
+                value = float(str(value).replace("$", "").replace(",", ""))
+            except ValueError:
+                continue
+        elif key == "weight":
+            try:
+                value = int(float(str(value).replace(",", "")))
+            except ValueError:
+                continue
+        if payload.get(key) != value:
+            payload[key] = value
+            changed.append(key)
+    if payload.get("total_rate") is None and payload.get("amount_due") is not None:
+        payload["total_rate"] = payload["amount_due"]
+    for key in ("detention", "lumper"):
+        if payload.get(key) is not None:
+            payload.setdefault("accessorials", {})[key] = payload[key]
+    if any(k.startswith(("origin_", "destination_")) for k in changed):
+        _normalize_places(payload)
+    return changed
+
+
 # --- Optional LLM extraction: Gemini (preferred, google-genai) or GPT-4o-mini ---
 # Try these in order; first that works with your API key is used (free tier varies by region/key).
 GEMINI_MODEL_FALLBACKS = ("gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash-8b", "gemini-1.5-flash")
@@ -440,6 +591,21 @@ Text:
 """
 
 
+_PARTIAL_PROMPT = """Extract from this OCR text from a freight invoice/BOL. Return only valid JSON with exactly these keys (use null if not found): {fields}.
+Dates as YYYY-MM-DD; amounts and weight as numbers. Origin is the address under PU 1 / PU / Pickup; destination is the address under SO 2 / SO / Delivery.
+total_rate/amount_due is the total $ for the load (never a per-mile rate); line_haul is the freight charge before accessorials.
+
+Text:
+"""
+
+
+def _llm_prompt(fields: list[str] | None) -> str:
+    """Full extraction prompt, or one asking only for `fields` (fewer output tokens for gap filling)."""
+    if not fields:
+        return _EXTRACT_PROMPT
+    return _PARTIAL_PROMPT.format(fields=", ".join(fields))
+
+
 def _parse_llm_json(content: str) -> dict | None:
     import json
     content = (content or "{}").strip().removeprefix("```json").removeprefix("```").strip()
@@ -454,7 +620,7 @@ def _parse_llm_json(content: str) -> dict | None:
         return None
 
 
-def _extract_with_gemini(raw_text: str, model: str | None = None) -> dict | None:
+def _extract_with_gemini(raw_text: str, model: str | None = None, fields: list[str] | None = None) -> dict | None:
     """Extract structured fields using Google Gemini (google-genai SDK). Set GOOGLE_API_KEY in .env.local."""
     api_key = os.environ.get("GOOGLE_API_KEY") or os.environ.get("GEMINI_API_KEY")
     if not api_key:
@@ -469,7 +635,7 @@ def _extract_with_gemini(raw_text: str, model: str | None = None) -> dict | None
         try:
             response = client.models.generate_content(
                 model=model_name,
-                contents=_EXTRACT_PROMPT + raw_text[:12000],
+                contents=_llm_prompt(fields) + raw_text[:12000],
                 config={"max_output_tokens": 800},
             )
             text = (getattr(response, "text", None) or "").strip()
@@ -487,7 +653,7 @@ def _extract_with_gemini(raw_text: str, model: str | None = None) -> dict | None
     return None
 
 
-def _extract_with_openai(raw_text: str, model: str | None = None) -> dict | None:
+def _extract_with_openai(raw_text: str, model: str | None = None, fields: list[str] | None = None) -> dict | None:
     """Extract structured fields using OpenAI. Set OPENAI_API_KEY for GPT-4o-mini."""
     try:
         from openai import OpenAI
@@ -495,7 +661,7 @@ def _extract_with_openai(raw_text: str, model: str | None = None) -> dict | None
         model_name = model or os.environ.get("OPENAI_MODEL", OPENAI_EXTRACT_MODEL)
         resp = client.chat.completions.create(
             model=model_name,
-            messages=[{"role": "user", "content": _EXTRACT_PROMPT + raw_text[:12000]}],
+            messages=[{"role": "user", "content": _llm_prompt(fields) + raw_text[:12000]}],
             max_tokens=800,
         )
         content = resp.choices[0].message.content or "{}"
@@ -505,16 +671,27 @@ def _extract_with_openai(raw_text: str, model: str | None = None) -> dict | None
         return None
 
 
-def extract_with_llm(raw_text: str, model: str | None = None) -> dict | None:
-    """Use OpenAI only for LLM extraction (set OPENAI_API_KEY in .env.local)."""
+def extract_with_llm(raw_text: str, model: str | None = None, fields: list[str] | None = None) -> dict | None:
+    """Use OpenAI only for LLM extraction (set OPENAI_API_KEY in .env.local). fields limits the request to those keys."""
     if os.environ.get("OPENAI_API_KEY"):
-        return _extract_with_openai(raw_text, model=model)
+        return _extract_with_openai(raw_text, model=model, fields=fields)
     print("Set OPENAI_API_KEY in .env.local for LLM extraction.", file=sys.stderr)
     return None
 
 
 # --- Miles and rate per mile (origin/dest -> OSRM distance; rate_per_mile = cost / miles) ---
-def _geocode(city: str, state: str, zip_code: str | None) -> tuple[float, float] | None:
+def _offline_coords(city: str, state: str, zip_code: str | None, budget: Budget | None = None) -> tuple[float, float] | None:
+    """(lat, lng) from the bundled gazetteer, so most places need no Nominatim round trip."""
+    gz = get_gazetteer()
+    place = gz.resolve(city, state, zip_code) if gz else None
+    if not place:
+        return None
+    if budget is not None:
+        budget.count("gazetteer", "ok")
+    return (place["lat"], place["lng"])
+
+
+def _geocode(city: str, state: str, zip_code: str | None, budget: Budget | None = None) -> tuple[float, float] | None:
     """Return (lat, lng) for a US address using Nominatim. Tries full address then city+state (title-case) for robustness."""
     if not (city or state):
         return None
@@ -525,17 +702,13 @@ def _geocode(city: str, state: str, zip_code: str | None) -> tuple[float, float]
     def _try(parts: list) -> tuple[float, float] | None:
         if not parts:
             return None
-        try:
-            from geopy.geocoders import Nominatim
-            from geopy.extra.rate_limiter import RateLimiter
-            geocoder = Nominatim(user_agent="freightbite-pdf-extract")
-            geocode = RateLimiter(geocoder.geocode, min_delay_seconds=1.0)
-            addr = ", ".join(parts) + ", USA"
-            loc = geocode(addr)
-            if loc:
-                return (loc.latitude, loc.longitude)
-        except Exception:
-            pass
+        addr = ", ".join(parts) + ", USA"
+        data = default_client().get_json("nominatim", "/search", {"q": addr, "format": "json", "limit": 1}, budget)
+        if data:
+            try:
+                return (float(data[0]["lat"]), float(data[0]["lon"]))
+            except (KeyError, IndexError, TypeError, ValueError):
+                pass
         return None
 
     # Title-case city helps Nominatim (e.g. FILLMORE -> Fillmore, WAVERLY -> Waverly)
@@ -552,29 +725,22 @@ def _geocode(city: str, state: str, zip_code: str | None) -> tuple[float, float]
     return None
 
 
-def _driving_miles(origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float) -> float | None:
+def _driving_miles(origin_lat: float, origin_lng: float, dest_lat: float, dest_lng: float, budget: Budget | None = None) -> float | None:
     """Return driving distance in miles via OSRM."""
-    try:
-        import urllib.request
-        import urllib.parse
-        coords = f"{origin_lng},{origin_lat};{dest_lng},{dest_lat}"
-        url = f"http://router.project-osrm.org/route/v1/driving/{coords}?overview=false"
-        with urllib.request.urlopen(url, timeout=10) as resp:
-            import json
-            data = json.loads(resp.read().decode())
-            if data.get("code") == "Ok" and data.get("routes"):
-                meters = data["routes"][0]["distance"]
-                return round(meters * 0.000621371, 1)
-    except Exception:
-        pass
+    coords = f"{origin_lng},{origin_lat};{dest_lng},{dest_lat}"
+    data = default_client().get_json("osrm", f"/route/v1/driving/{coords}", {"overview": "false"}, budget)
+    if data and data.get("code") == "Ok" and data.get("routes"):
+        meters = data["routes"][0]["distance"]
+        return round(meters * 0.000621371, 1)
     return None
 
 
-def compute_miles_and_rate_per_mile(extracted: dict) -> None:
+def compute_miles_and_rate_per_mile(extracted: dict, budget: Budget | None = None) -> None:
     """Set miles and rate_per_mile for every invoice. Base cost = first of amount_due, total_rate, line_haul (COST_FIELDS_BASE).
     When origin + destination exist: use the two addresses to calculate miles (OSRM), then rate_per_mile = base_cost / miles.
     When no origin/dest: if PDF has rate_per_mile + base_cost, miles = base_cost / rate_per_mile.
-    Always set rate_per_mile = cost / miles when both cost and miles are available."""
+    Always set rate_per_mile = cost / miles when both cost and miles are available.
+    Lookups share one per-document time budget; skipped/failed lookups leave miles None."""
     if not extracted:
         return
     base_cost = next((extracted.get(k) for k in COST_FIELDS_BASE if extracted.get(k) is not None), None)
@@ -589,11 +755,13 @@ def compute_miles_and_rate_per_mile(extracted: dict) -> None:
     has_two_destinations = (origin_city or origin_state) and (dest_city or dest_state)
 
     if has_two_destinations:
-        origin_ll = _geocode(origin_city, origin_state, origin_zip)
-        time.sleep(1.0)
-        dest_ll = _geocode(dest_city, dest_state, dest_zip)
+        budget = budget or Budget()
+        origin_ll = _offline_coords(origin_city, origin_state, origin_zip, budget) or _geocode(origin_city, origin_state, origin_zip, budget)
+        dest_ll = None
+        if origin_ll:
+            dest_ll = _offline_coords(dest_city, dest_state, dest_zip, budget) or _geocode(dest_city, dest_state, dest_zip, budget)
         if origin_ll and dest_ll:
-            miles = _driving_miles(origin_ll[0], origin_ll[1], dest_ll[0], dest_ll[1])
+            miles = _driving_miles(origin_ll[0], origin_ll[1], dest_ll[0], dest_ll[1], budget)
             extracted["miles"] = miles
             if miles and miles > 0 and base_cost and base_cost > 0:
                 extracted["rate_per_mile"] = round(base_cost / miles, 2)
@@ -694,42 +862,121 @@ def ensure_company_with_info(
     return None
 
 
+def _verified_duplicate(sb, dedup: DedupIndex, find) -> dict | None:
+    """Return the first hit from find() whose document still exists in Supabase. Hits for deleted documents
+    (or from an index built against another database) are dropped from the index; if the lookup itself
+    fails, no hit is trusted and the upload is processed as new."""
+    hit = find()
+    while hit:
+        try:
+            r = sb.table("documents").select("id").eq("id", hit["document_id"]).limit(1).execute()
+        except Exception as e:
+            print(f"Dedup hit {hit['document_id']} not verified, processing as new: {e}", file=sys.stderr)
+            return None
+        if r.data:
+            return hit
+        dedup.remove(hit["document_id"])
+        hit = find()
+    return None
+
+
 def process_pdf(
     pdf_path: str,
     user_id: str | None,
     sb,
     use_llm: bool = False,
     document_type: str = "invoice",
+    dedup: DedupIndex | None = None,
+    lanes: LaneAggregates | None = None,
+    incremental_ocr: bool = False,
 ) -> dict:
-    """OCR PDF, extract data, insert document + company + rate. Returns {document_id, extracted, error}."""
+    """OCR PDF, extract data, insert document + company + rate. Returns {document_id, created_at, extracted, error, duplicate, lookups, extraction}.
+    With a dedup index, a near-duplicate of an already processed upload returns the existing document_id
+    (duplicate=True) without inserting new documents/rates rows. With lane aggregates, each inserted rate
+    is also folded into the lane's running stats. With incremental_ocr, OCR stops at the first page where
+    the required fields are complete; the remaining pages are queued for background OCR."""
     pdf_path = Path(pdf_path)
     if not pdf_path.is_file() or pdf_path.suffix.lower() != ".pdf":
         return {"document_id": None, "extracted": None, "error": "Not a PDF file"}
 
+    # Perceptual page hashes from a low-res render: pages that look like a stored upload are candidates
+    page_hashes = []
+    candidates = []
+    if dedup is not None:
+        try:
+            page_hashes = pdf_page_hashes(str(pdf_path))
+            candidates = dedup.page_candidates(page_hashes, user_id)
+        except Exception as e:
+            print(f"Dedup page lookup failed: {e}", file=sys.stderr)
+
+    # Render + OCR page by page. Incremental mode stops once the required fields for document_type are all
+    # found and consistent; skipped pages are queued for background OCR (--complete-ocr) to finish raw_text.
     try:
-        images = pdf_to_images(str(pdf_path))
-        raw_text = ocr_images(images)
+        doc = fitz.open(str(pdf_path))
     except Exception as e:
         return {"document_id": None, "extracted": None, "error": f"OCR failed: {e}"}
+    try:
+        page_count = len(doc)
+        page_texts = ocr_pages([render_page(doc, 0)]) if page_count else []
 
-    if use_llm and os.environ.get("OPENAI_API_KEY"):
-        extracted = extract_with_llm(raw_text)
-        if extracted is None:
-            extracted = extract_structured(raw_text)
-        else:
-            extracted.setdefault("accessorials", {})
-            if extracted.get("detention") is not None:
-                extracted["accessorials"]["detention"] = extracted["detention"]
-            if extracted.get("lumper") is not None:
-                extracted["accessorials"]["lumper"] = extracted["lumper"]
-    else:
-        extracted = extract_structured(raw_text)
+        # Same-template invoices hash alike, so confirm a candidate by the fields on the first page before OCR'ing the rest
+        # Only needed to confirm candidates now or to store with the document for later uploads
+        first_page_fingerprint = (
+            fields_fingerprint(extract_structured(page_texts[0])) if page_texts and dedup is not None else None
+        )
+        if candidates:
+            try:
+                hit = _verified_duplicate(sb, dedup, lambda: dedup.confirm(candidates, first_page_fingerprint))
+                if hit:
+                    return {"document_id": hit["document_id"], "extracted": hit["extracted"], "error": None, "duplicate": True}
+            except Exception as e:
+                print(f"Dedup confirm failed: {e}", file=sys.stderr)
+
+        for i in range(1, page_count):
+            if incremental_ocr:
+                partial = assess_extraction(extract_structured("\n\n".join(page_texts)), document_type)
+                if not partial["missing"] and not partial["issues"]:
+                    break
+            page_texts += ocr_pages([render_page(doc, i)])
+    except Exception as e:
+        return {"document_id": None, "extracted": None, "error": f"OCR failed: {e}"}
+    finally:
+        doc.close()
+    pending_pages = list(range(len(page_texts), page_count))
+    raw_text = "\n\n".join(page_texts)
+
+    # Regex first; the LLM only fills missing required fields or settles inconsistent ones
+    extracted = extract_structured(raw_text)
+    assessment = assess_extraction(extracted, document_type)
+    assessment["llm_used"] = False
+    if use_llm and os.environ.get("OPENAI_API_KEY") and assessment["llm_fields"]:
+        llm = extract_with_llm(raw_text, fields=assessment["llm_fields"])
+        if llm is not None:
+            assessment["llm_used"] = True
+            assessment["llm_changed"] = merge_llm_fields(extracted, llm, assessment["llm_fields"])
+
+    # Same parsed fields as a stored document (pixels too different for the page hashes): reuse it
+    fingerprint = fields_fingerprint(extracted)
+    if dedup is not None and fingerprint:
+        try:
+            hit = _verified_duplicate(sb, dedup, lambda: dedup.find_by_fingerprint(fingerprint, user_id))
+            if hit:
+                dedup.add(hit["document_id"], user_id, page_hashes)
+                return {"document_id": hit["document_id"], "extracted": hit["extracted"], "error": None, "duplicate": True}
+        except Exception as e:
+            print(f"Dedup fingerprint lookup failed: {e}", file=sys.stderr)
 
-    # Compute miles (origin → dest via OSRM) and rate per mile = total rate / miles
-    compute_miles_and_rate_per_mile(extracted)
+    # Compute miles (origin → dest via OSRM) and rate per mile = total rate / miles, within the enrichment budget
+    budget = Budget()
+    compute_miles_and_rate_per_mile(extracted, budget)
+    lookups = budget.summary()
 
     # Supabase documents: filename, file_type, document_type, status, raw_text, metadata (JSONB), user_id (optional)
-    metadata = {"extracted": extracted}
+    metadata = {
+        "extracted": extracted,
+        "extraction": assessment,
+        "ocr": {"pages": page_count, "ocr_pages": len(page_texts), "pending_pages": pending_pages},
+    }
     if user_id:
         metadata["user_id"] = user_id
     doc_row = {
@@ -743,6 +990,7 @@ def process_pdf(
     if user_id:
         doc_row["user_id"] = user_id
 
+    inserted_at = datetime.now(timezone.utc).isoformat()
     try:
         ins = sb.table("documents").insert(doc_row).execute()
         if not ins.data or len(ins.data) == 0:
@@ -844,20 +1092,354 @@ def process_pdf(
             sb.table("rates").insert(row).execute()
         except Exception as e:
             print(f"Rate insert failed: {e}", file=sys.stderr)
+        else:
+            if lanes is not None:
+                try:
+                    lanes.record_extracted(extracted, base_cost)
+                except Exception as e:
+                    print(f"Lane aggregate update failed: {e}", file=sys.stderr)
 
-    return {"document_id": doc_id, "extracted": extracted, "error": None}
+    if pending_pages:
+        try:
+            queue_background_ocr(pdf_path, doc_id, pending_pages)
+        except Exception as e:
+            print(f"Background OCR queue failed: {e}", file=sys.stderr)
+
+    if dedup is not None:
+        try:
+            dedup.add(doc_id, user_id, page_hashes, fingerprint, first_page_fingerprint, extracted)
+        except Exception as e:
+            print(f"Dedup index update failed: {e}", file=sys.stderr)
+
+    return {
+        "document_id": doc_id,
+        # documents.created_at as stored (falls back to the insert time if the row was not returned with it)
+        "created_at": (ins.data[0].get("created_at") if ins.data else None) or inserted_at,
+        "extracted": extracted,
+        "error": None,
+        "duplicate": False,
+        "lookups": lookups,
+        "extraction": assessment,
+    }
+
+
+# --- Background OCR of pages skipped by incremental mode ---
+OCR_CLAIM_STALE_S = 3600
+
+
+def _ocr_spool_dir() -> Path:
+    env = os.environ.get("EXTRACT_OCR_SPOOL")
+    return Path(env) if env else Path(__file__).resolve().parent / "state" / "ocr_pending"
+
+
+def queue_background_ocr(pdf_path: Path, document_id, pages: list[int]) -> Path:
+    """Keep a copy of the PDF (upload temp files are deleted) plus the page list for complete_pending_ocr()."""
+    spool = _ocr_spool_dir()
+    spool.mkdir(parents=True, exist_ok=True)
+    job = spool / f"{document_id}.json"
+    shutil.copyfile(pdf_path, spool / f"{document_id}.pdf")
+    job.write_text(json.dumps({"document_id": str(document_id), "pages": pages}))
+    # Also hand it to queue workers (backfill pool); --complete-ocr still drains the spool directly
+    try:
+        queue = JobQueue()
+        try:
+            queue.enqueue("complete_ocr", {"spec": str(job)}, pool="backfill")
+        finally:
+            queue.close()
+    except Exception as e:
+        print(f"Job queue unavailable, OCR left for --complete-ocr: {e}", file=sys.stderr)
+    return job
+
+
+def complete_document_ocr(sb, document_id: str, pdf_path: Path, pages: list[int]) -> None:
+    """OCR the given pages and append them to documents.raw_text; clears metadata.ocr.pending_pages."""
+    doc = fitz.open(str(pdf_path))
+    try:
+        texts = ocr_pages([render_page(doc, i) for i in pages if i < len(doc)])
+    finally:
+        doc.close()
+    r = sb.table("documents").select("raw_text, metadata").eq("id", document_id).limit(1).execute()
+    if not r.data:
+        return
+    row = r.data[0]
+    raw_text = "\n\n".join([row.get("raw_text") or ""] + texts)
+    metadata = row.get("metadata") or {}
+    ocr = metadata.setdefault("ocr", {})
+    ocr["ocr_pages"] = ocr.get("ocr_pages", 0) + len(texts)
+    ocr["pending_pages"] = []
+    sb.table("documents").update({
+        "raw_text": raw_text[:50000],
+        "metadata": metadata,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }).eq("id", document_id).execute()
+
+
+def complete_spooled_ocr(sb, job: Path) -> bool:
+    """Complete one spooled OCR job and remove it; False if it was already done or claimed elsewhere.
+    The spec is claimed by renaming it to *.json.working first, so a queue worker and --complete-ocr
+    never both append the same pages."""
+    working = job.with_name(job.name + ".working")
+    try:
+        os.rename(job, working)
+    except FileNotFoundError:
+        return False
+    os.utime(working)
+    pdf = job.with_suffix(".pdf")
+    try:
+        spec = json.loads(working.read_text())
+        complete_document_ocr(sb, spec["document_id"], pdf, spec["pages"])
+    except Exception:
+        # Release the claim so a retry (queue backoff or the next --complete-ocr) can pick it up
+        os.rename(working, job)
+        raise
+    working.unlink(missing_ok=True)
+    pdf.unlink(missing_ok=True)
+    return True
+
+
+def complete_pending_ocr(sb) -> int:
+    """Process every queued background OCR job; returns how many documents were completed."""
+    spool = _ocr_spool_dir()
+    # A claim older than this was left by a process that died mid-OCR: release it
+    for claimed in spool.glob("*.json.working"):
+        try:
+            if time.time() - claimed.stat().st_mtime > OCR_CLAIM_STALE_S:
+                os.replace(claimed, claimed.with_suffix(""))
+        except OSError:
+            pass
+    done = 0
+    for job in sorted(spool.glob("*.json")):
+        try:
+            done += complete_spooled_ocr(sb, job)
+        except Exception as e:
+            print(f"Background OCR failed for {job.stem}: {e}", file=sys.stderr)
+    return done
+
+
+# --- Job queue: enqueue uploads/backfills, run workers (see job_queue.py) ---
+def _queue_files_dir() -> Path:
+    env = os.environ.get("EXTRACT_QUEUE_FILES")
+    return Path(env) if env else Path(__file__).resolve().parent / "state" / "queue_files"
+
+
+def enqueue_pdfs(
+    queue: JobQueue,
+    files: list[Path],
+    user_id: str | None,
+    pool: str,
+    use_llm: bool = False,
+    document_type: str = "invoice",
+    incremental_ocr: bool = False,
+) -> list[int]:
+    """Copy each PDF into the queue's file store (upload temp files are deleted) and enqueue an extract job."""
+    store = _queue_files_dir()
+    store.mkdir(parents=True, exist_ok=True)
+    ids = []
+    for f in files:
+        # One directory per job keeps the original filename for documents.filename
+        kept = store / uuid.uuid4().hex / f.name
+        kept.parent.mkdir()
+        shutil.copyfile(f, kept)
+        ids.append(queue.enqueue("extract", {
+            "pdf": str(kept),
+            "filename": f.name,
+            "user_id": user_id,
+            "document_type": document_type,
+            "use_llm": use_llm,
+            "incremental_ocr": incremental_ocr,
+        }, pool=pool))
+    return ids
+
+
+QUEUE_FILES_GRACE_S = 3600
+
+
+def sweep_queue_files(queue: JobQueue) -> int:
+    """Remove PDF copies whose extract job is no longer queued or running (e.g. failed by claim() after its
+    lease expired on the last attempt). Directories younger than QUEUE_FILES_GRACE_S are kept: enqueue_pdfs
+    copies the file before the job row exists. Returns how many were removed."""
+    store = _queue_files_dir()
+    if not store.is_dir():
+        return 0
+    needed = {Path(p["pdf"]).parent.name for p in queue.active_payloads("extract") if p.get("pdf")}
+    removed = 0
+    for d in store.iterdir():
+        try:
+            if d.is_dir() and d.name not in needed and time.time() - d.stat().st_mtime > QUEUE_FILES_GRACE_S:
+                shutil.rmtree(d, ignore_errors=True)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def run_job(job: dict, sb, dedup: DedupIndex | None, lanes: LaneAggregates | None) -> tuple[dict, str | None]:
+    """Run one claimed job. Returns (result, error); error is None on success."""
+    payload = job["payload"]
+    if job["kind"] == "extract":
+        out = process_pdf(
+            payload["pdf"],
+            payload.get("user_id"),
+            sb,
+            use_llm=payload.get("use_llm", False),
+            document_type=payload.get("document_type", "invoice"),
+            dedup=dedup,
+            lanes=lanes,
+            incremental_ocr=payload.get("incremental_ocr", False),
+        )
+        result = {
+            "filename": payload.get("filename"),
+            "document_id": out.get("document_id"),
+            "error": out.get("error"),
+            "duplicate": bool(out.get("duplicate")),
+            "lookups": out.get("lookups"),
+        }
+        return result, out.get("error")
+    if job["kind"] == "complete_ocr":
+        completed = complete_spooled_ocr(sb, Path(payload["spec"]))
+        return {"completed": completed}, None
+    return {}, f"Unknown job kind: {job['kind']}"
+
+
+def _heartbeat(job: dict, visibility_timeout: float, stop: threading.Event) -> None:
+    """Renew the job's lease while it runs (own connection: SQLite connections stay in their thread).
+    Stops once the lease is lost, so it never extends another worker's claim."""
+    queue = JobQueue()
+    try:
+        while not stop.wait(visibility_timeout / 3):
+            if not queue.heartbeat(job, visibility_timeout):
+                print(f"Job {job['id']}: lease lost, another worker may be running it", file=sys.stderr)
+                return
+    finally:
+        queue.close()
+
+
+def run_worker(
+    sb,
+    pools: tuple[str, ...],
+    worker_id: str,
+    use_dedup: bool = True,
+    drain: bool = False,
+    poll_interval: float = 1.0,
+    visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT_S,
+) -> int:
+    """Claim and run jobs until stopped (or, with drain, until nothing is claimable). Returns jobs run."""
+    queue = JobQueue()
+    try:
+        sweep_queue_files(queue)
+    except Exception as e:
+        print(f"Queue file sweep failed: {e}", file=sys.stderr)
+    dedup = DedupIndex() if use_dedup else None
+    lanes = LaneAggregates()
+    ran = 0
+    try:
+        while True:
+            job = queue.claim(worker_id, pools, visibility_timeout)
+            if job is None:
+                if drain:
+                    return ran
+                time.sleep(poll_interval)
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat, args=(job, visibility_timeout, stop), daemon=True)
+            beat.start()
+            try:
+                result, error = run_job(job, sb, dedup, lanes)
+            except Exception as e:
+                result, error = {}, str(e)
+            finally:
+                stop.set()
+                beat.join()
+            ran += 1
+            if error is None:
+                owned = queue.complete(job, result)
+            else:
+                transient = is_transient_error(error)
+                owned = queue.fail(job, error, transient=transient, result=result)
+                print(f"Job {job['id']} failed ({'will retry' if transient else 'permanent'}): {error}", file=sys.stderr)
+            if not owned:
+                # Lease expired mid-run: the job (and its PDF copy) now belongs to whoever re-claimed or failed it
+                print(f"Job {job['id']}: lease lost before finishing, result discarded", file=sys.stderr)
+                continue
+            final = queue.get(job["id"])
+            if job["kind"] == "extract" and final and final["status"] in ("done", "failed"):
+                shutil.rmtree(Path(job["payload"]["pdf"]).parent, ignore_errors=True)
+    finally:
+        queue.close()
+        if dedup is not None:
+            dedup.close()
+        lanes.close()
+
+
+def run_workers(sb, pools: tuple[str, ...], concurrency: int, use_dedup: bool = True, drain: bool = False) -> int:
+    """Run `concurrency` worker threads (OCR runs in tesseract subprocesses, so threads overlap well)."""
+    totals = []
+    threads = [
+        threading.Thread(
+            target=lambda n: totals.append(run_worker(sb, pools, f"{socket.gethostname()}:{os.getpid()}:{n}", use_dedup, drain)),
+            args=(n,),
+            # Daemon: Ctrl-C stops the process; unfinished jobs are re-claimed once their lease expires
+            daemon=True,
+        )
+        for n in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(totals)
 
 
 def main():
     ap = argparse.ArgumentParser(description="Extract invoice/BOL data from scanned PDFs and save to Supabase")
-    ap.add_argument("path", help="Path to a PDF file or directory of PDFs")
+    ap.add_argument("path", nargs="?", help="Path to a PDF file or directory of PDFs")
     ap.add_argument("--user-id", dest="user_id", default=os.environ.get("SUPABASE_USER_ID"), help="Supabase Auth user ID (links document to account)")
-    ap.add_argument("--use-llm", action="store_true", default=os.environ.get("EXTRACT_USE_LLM") == "1", help="Use OpenAI to parse OCR text (set OPENAI_API_KEY)")
+    ap.add_argument("--use-llm", action="store_true", default=os.environ.get("EXTRACT_USE_LLM") == "1", help="Use OpenAI to fill fields the regex parser missed or got inconsistent (set OPENAI_API_KEY)")
     ap.add_argument("--document-type", default="invoice", choices=["invoice", "bol", "rate_sheet", "contract", "other"], help="document_type for Supabase")
-    ap.add_argument("--json-output", action="store_true", help="Print machine-readable JSON payload")
+    output = ap.add_mutually_exclusive_group()
+    output.add_argument("--json-output", action="store_true", help="Print machine-readable JSON payload")
+    output.add_argument("--jsonl", action="store_true", help="Stream JSON lines: progress, one result per document as it finishes, then a summary")
+    ap.add_argument("--incremental-ocr", action="store_true", default=os.environ.get("EXTRACT_INCREMENTAL_OCR") == "1", help="Stop OCR once the required fields are found; queue remaining pages for --complete-ocr")
+    ap.add_argument("--complete-ocr", action="store_true", help="OCR pages queued by --incremental-ocr and append them to documents.raw_text")
+    ap.add_argument("--no-dedup", dest="dedup", action="store_false", default=os.environ.get("EXTRACT_DEDUP") != "0", help="Always reprocess, even near-duplicates of earlier uploads")
+    queue_args = ap.add_argument_group("job queue (job_queue.py)")
+    queue_args.add_argument("--enqueue", action="store_true", help="Queue the PDF(s) for queue workers instead of processing them now; prints the job ids")
+    queue_args.add_argument("--pool", choices=POOLS, default=None, help="Pool for --enqueue (default: interactive for a file, backfill for a directory)")
+    queue_args.add_argument("--worker", action="store_true", help="Run queue workers: claim jobs and process them")
+    queue_args.add_argument("--pools", default=",".join(POOLS), help="Comma-separated pools this worker claims from (default: all)")
+    queue_args.add_argument("--concurrency", type=int, default=int(os.environ.get("EXTRACT_WORKER_CONCURRENCY", "1")), help="Worker threads in this process")
+    queue_args.add_argument("--drain", action="store_true", help="With --worker: exit once no job is claimable instead of polling")
+    queue_args.add_argument("--queue-stats", action="store_true", help="Print queue depth per pool/status as JSON")
+    queue_args.add_argument("--job-status", type=int, metavar="JOB_ID", help="Print one job (status, attempts, result) as JSON")
     args = ap.parse_args()
 
+    if args.queue_stats or args.job_status is not None:
+        queue = JobQueue()
+        try:
+            if args.queue_stats:
+                out = queue.metrics()
+                out["swept_files"] = sweep_queue_files(queue)
+            else:
+                out = queue.get(args.job_status)
+        finally:
+            queue.close()
+        print(json.dumps(out, ensure_ascii=False, default=str))
+        return
+
     sb = get_supabase()
+    if args.complete_ocr:
+        print(f"Completed OCR for {complete_pending_ocr(sb)} document(s).")
+        return
+    if args.worker:
+        pools = tuple(p.strip() for p in args.pools.split(",") if p.strip())
+        unknown = [p for p in pools if p not in POOLS]
+        if unknown or not pools:
+            ap.error(f"--pools must be a comma-separated subset of {','.join(POOLS)}")
+        ran = run_workers(sb, pools, max(args.concurrency, 1), use_dedup=args.dedup, drain=args.drain)
+        print(f"Ran {ran} job(s).")
+        return
+    if not args.path:
+        ap.error("path is required unless --complete-ocr, --worker, --queue-stats or --job-status is given")
     path = Path(args.path)
     if path.is_file():
         files = [path]
@@ -867,23 +1449,65 @@ def main():
         print("Path not found:", path, file=sys.stderr)
         sys.exit(1)
 
+    if args.enqueue:
+        pool = args.pool or ("interactive" if path.is_file() else "backfill")
+        queue = JobQueue()
+        try:
+            ids = enqueue_pdfs(queue, files, args.user_id, pool, args.use_llm, args.document_type, args.incremental_ocr)
+        finally:
+            queue.close()
+        print(json.dumps({"pool": pool, "jobs": ids}))
+        return
+
+    def emit(record: dict) -> None:
+        # One line per record, flushed so the caller can act on each document immediately
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    dedup = DedupIndex() if args.dedup else None
+    lanes = LaneAggregates()
     results = []
-    for f in files:
-        out = process_pdf(str(f), args.user_id, sb, use_llm=args.use_llm, document_type=args.document_type)
-        results.append({
+    counts = {"processed": 0, "errors": 0, "duplicates": 0}
+    started = time.monotonic()
+    for i, f in enumerate(files):
+        if args.jsonl:
+            emit({"type": "progress", "index": i, "total": len(files), "filename": f.name})
+        out = process_pdf(str(f), args.user_id, sb, use_llm=args.use_llm, document_type=args.document_type, dedup=dedup, lanes=lanes, incremental_ocr=args.incremental_ocr)
+        result = {
             "filename": f.name,
             "document_id": out.get("document_id"),
+            "created_at": out.get("created_at"),
             "extracted": out.get("extracted"),
             "error": out.get("error"),
-        })
-        if not args.json_output:
-            print("Processing:", f.name)
-            if out["error"]:
-                print("  Error:", out["error"])
-            else:
-                print("  Document ID:", out["document_id"])
-                print("  Extracted:", out["extracted"])
-    if args.json_output:
+            "duplicate": bool(out.get("duplicate")),
+            "lookups": out.get("lookups"),
+            "extraction": out.get("extraction"),
+        }
+        counts["processed"] += 1
+        counts["errors"] += 1 if out.get("error") else 0
+        counts["duplicates"] += 1 if out.get("duplicate") else 0
+        if args.jsonl:
+            emit({"type": "result", **result})
+            continue
+        if args.json_output:
+            results.append(result)
+            continue
+        print("Processing:", f.name)
+        if out["error"]:
+            print("  Error:", out["error"])
+        elif out.get("duplicate"):
+            print("  Duplicate of document ID:", out["document_id"])
+        else:
+            print("  Document ID:", out["document_id"])
+            print("  Extracted:", out["extracted"])
+            if out.get("lookups", {}).get("degraded"):
+                print("  Lookups degraded:", out["lookups"])
+    if dedup is not None:
+        dedup.close()
+    lanes.close()
+    if args.jsonl:
+        emit({"type": "summary", "total": len(files), **counts, "elapsed_s": round(time.monotonic() - started, 2)})
+    elif args.json_output:
         print(json.dumps({"results": results}, ensure_ascii=False))
     else:
         print("Done.")
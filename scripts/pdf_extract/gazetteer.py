@@ -0,0 +1,218 @@
+"""
+Offline US gazetteer for normalizing OCR'd places before geocoding.
+
+Bundled data: data/us_zips.tsv.gz (zip, city, state, lat, lng, acceptable city
+aliases), generated from the MIT-licensed `zipcodes` package with
+`python gazetteer.py --build`. Loaded lazily into:
+
+- zip -> (city, state, lat, lng)
+- per state: city -> zips, plus the city names sorted by length so fuzzy lookups
+  only run edit distance against names of similar length.
+
+resolve() corrects OCR noise (WAVERIY -> WAVERLY, 0H -> OH), picks the real city
+out of multi-word captures ("ROCK CITY" rather than "CITY"), fills in a missing
+state or zip, and returns coordinates so most lanes need no Nominatim round trip.
+"""
+
+import argparse
+import bisect
+import gzip
+from pathlib import Path
+
+DATA_PATH = Path(__file__).resolve().parent / "data" / "us_zips.tsv.gz"
+# Common OCR confusions in two-letter state codes
+_STATE_OCR_FIXES = str.maketrans({"0": "O", "1": "I", "5": "S", "8": "B", "4": "A", "6": "G"})
+
+_index = None
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """Levenshtein distance, giving up (returns max_distance + 1) once every path exceeds max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev = cur
+    return prev[-1]
+
+
+def _max_distance(name: str) -> int:
+    # Short tokens (ST, RD, CO) are too close to too many tiny towns to correct
+    if len(name) <= 3:
+        return 0
+    return 1 if len(name) <= 5 else 2
+
+
+def _norm_city(s: str | None) -> str:
+    return " ".join((s or "").replace(".", " ").replace(",", " ").upper().split())
+
+
+class Gazetteer:
+    def __init__(self, path: Path = DATA_PATH):
+        self.zips = {}  # zip -> (city, state, lat, lng)
+        self.cities = {}  # state -> {city: [zip, ...]}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                z, city, state, lat, lng, aliases = line.rstrip("\n").split("\t")
+                self.zips[z] = (city, state, float(lat), float(lng))
+                by_city = self.cities.setdefault(state, {})
+                for name in [city] + [a for a in aliases.split(";") if a]:
+                    by_city.setdefault(name, []).append(z)
+        # Per state: names sorted by length (parallel list of lengths for bisect)
+        self._by_len = {}
+        for state, by_city in self.cities.items():
+            names = sorted(by_city, key=len)
+            self._by_len[state] = (names, [len(n) for n in names])
+
+    def states(self) -> set:
+        return set(self.cities)
+
+    def fix_state(self, state: str | None) -> str | None:
+        s = (state or "").strip().upper()[:2].translate(_STATE_OCR_FIXES)
+        return s if s in self.cities else None
+
+    def match_city(self, city: str, state: str) -> str | None:
+        """Exact city name in state, else the unique closest name within the edit-distance limit."""
+        by_city = self.cities.get(state)
+        name = _norm_city(city)
+        if not by_city or not name:
+            return None
+        if name in by_city:
+            return name
+        limit = _max_distance(name)
+        if limit == 0:
+            return None
+        names, lengths = self._by_len[state]
+        lo = bisect.bisect_left(lengths, len(name) - limit)
+        hi = bisect.bisect_right(lengths, len(name) + limit)
+        best, best_d, tie = None, limit + 1, False
+        for candidate in names[lo:hi]:
+            d = edit_distance(name, candidate, limit)
+            if d < best_d:
+                best, best_d, tie = candidate, d, False
+            elif d == best_d:
+                tie = True
+        return best if best and not tie else None
+
+    def city_from_words(self, words: list[str], state: str) -> str | None:
+        """Pick the city from the words before "ST ZIP" (street/company words may precede it): longest known suffix wins."""
+        for n in range(min(len(words), 4), 0, -1):
+            suffix = " ".join(words[-n:])
+            if _norm_city(suffix) in self.cities.get(state, {}):
+                return _norm_city(suffix)
+        for n in range(min(len(words), 4), 0, -1):
+            match = self.match_city(" ".join(words[-n:]), state)
+            if match:
+                return match
+        return None
+
+    def _centroid(self, zips: list[str]) -> tuple[float, float]:
+        pts = [self.zips[z] for z in zips]
+        return (round(sum(p[2] for p in pts) / len(pts), 4), round(sum(p[3] for p in pts) / len(pts), 4))
+
+    def resolve(self, city: str | None, state: str | None, zip_code: str | None) -> dict | None:
+        """Corrected {city, state, zip, lat, lng} for a US place, or None when it cannot be resolved offline.
+        A city that matches its zip gives the zip's coordinates; otherwise city+state wins over the zip."""
+        z = (zip_code or "").strip()[:5]
+        zip_entry = self.zips.get(z)
+        st = self.fix_state(state)
+        if zip_entry and st != zip_entry[1]:
+            # A readable state wins over the zip (one bad digit moves a zip across states); the zip's
+            # state is used only when the state is missing/unreadable or the city does not exist in it
+            if st is None or (city and not self.match_city(city, st) and self.match_city(city, zip_entry[1])):
+                st = zip_entry[1]
+        if not st:
+            return None
+        name = self.match_city(city, st) if city else None
+        if name is None:
+            if zip_entry and zip_entry[1] == st:
+                # Unknown city text (OCR garbage) but a valid zip: use the zip's place
+                return {"city": zip_entry[0], "state": st, "zip": z, "lat": zip_entry[2], "lng": zip_entry[3]}
+            return None
+        city_zips = self.cities[st][name]
+        if z in city_zips:
+            return {"city": name, "state": st, "zip": z, "lat": self.zips[z][2], "lng": self.zips[z][3]}
+        lat, lng = self._centroid(city_zips)
+        # Zip missing or inconsistent: keep it only if it is one edit away from one of the city's zips
+        fixed_zip = next((cz for cz in city_zips if z and edit_distance(z, cz, 1) <= 1), None)
+        if len(city_zips) == 1 and not fixed_zip:
+            fixed_zip = city_zips[0]
+        return {"city": name, "state": st, "zip": fixed_zip, "lat": lat, "lng": lng}
+
+
+def get_gazetteer() -> Gazetteer | None:
+    """Shared lazily loaded instance; None if the data file is missing."""
+    global _index
+    if _index is None and DATA_PATH.is_file():
+        _index = Gazetteer()
+    return _index
+
+
+def build(path: Path = DATA_PATH) -> int:
+    """Regenerate the bundled data file from the `zipcodes` package (pip install zipcodes; dev only)."""
+    import zipcodes
+
+    rows = []
+    for z in zipcodes.list_all():
+        if not z["active"] or not z["lat"] or z["zip_code_type"] == "MILITARY":
+            continue
+        aliases = ";".join(_norm_city(c) for c in z["acceptable_cities"])
+        rows.append(
+            "\t".join([z["zip_code"], _norm_city(z["city"]), z["state"], f"{float(z['lat']):.4f}", f"{float(z['long']):.4f}", aliases])
+        )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.GzipFile(path, "wb", compresslevel=9, mtime=0) as f:
+        f.write(("\n".join(rows) + "\n").encode("utf-8"))
+    return len(rows)
+
+
+# (city, state, zip) -> expected (city, state, zip); run with --self-check
+SELF_CHECK = [
+    (("WAVERIY", "NY", "14892"), ("WAVERLY", "NY", "14892")),
+    (("HIRAM", "0H", "44234"), ("HIRAM", "OH", "44234")),
+    (("HIRAM", None, "44234"), ("HIRAM", "OH", "44234")),
+    # Bad zip digit pointing into another state: keep the parsed state, repair the zip
+    (("COLUMBUS", "OH", "48215"), ("COLUMBUS", "OH", "43215")),
+    (("FRANKLIN", "TN", "07064"), ("FRANKLIN", "TN", "37064")),
+    (("SPRINGFIELD", "IL", "01104"), ("SPRINGFIELD", "IL", None)),
+    # City unknown in the parsed state but matches the zip: the state was misread
+    (("CHILLICOTHE", "NJ", "45601"), ("CHILLICOTHE", "OH", "45601")),
+]
+
+
+def self_check(g: Gazetteer) -> list[str]:
+    failures = []
+    for args, expected in SELF_CHECK:
+        got = g.resolve(*args)
+        got = (got["city"], got["state"], got["zip"]) if got else None
+        if got != expected:
+            failures.append(f"resolve{args}: expected {expected}, got {got}")
+    return failures
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline US gazetteer: resolve city/state/zip, or rebuild the data file")
+    ap.add_argument("--build", action="store_true", help="Regenerate data/us_zips.tsv.gz from the zipcodes package")
+    ap.add_argument("--self-check", action="store_true", help="Run the built-in resolve() cases and exit non-zero on failure")
+    ap.add_argument("--city")
+    ap.add_argument("--state")
+    ap.add_argument("--zip", dest="zip_code")
+    args = ap.parse_args()
+    if args.build:
+        print(f"Wrote {build()} zips to {DATA_PATH}")
+        return
+    g = get_gazetteer()
+    if args.self_check:
+        failures = self_check(g) if g else [f"Missing {DATA_PATH}"]
+        print("\n".join(failures) or f"OK ({len(SELF_CHECK)} cases)")
+        raise SystemExit(1 if failures else 0)
+    print(g.resolve(args.city, args.state, args.zip_code) if g else f"Missing {DATA_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Shared HTTP layer for external lookups (Nominatim geocoding, OSRM routing).
+
+- One requests.Session with keep-alive connection pooling for every lookup.
+- Budget: per-document time budget; a lookup that cannot finish inside it is skipped
+  and each request's timeout is capped by what is left.
+- CircuitBreaker per service: after repeated failures the service is skipped for a
+  cool-down period, then a single trial request decides whether it closes. State is
+  kept in a small (file-locked) JSON file so it carries across the
+  one-process-per-upload invocations from server.js.
+- Counters per document (ok / rejected / failed / skipped_circuit_open / skipped_budget) are
+  returned in the extractor output as "lookups".
+
+Env: NOMINATIM_BASE_URL, OSRM_BASE_URL (override upstreams, e.g. local stubs),
+     EXTRACT_ENRICH_BUDGET_S (per-document budget, default 8),
+     EXTRACT_BREAKER_FAILURES (consecutive failures to open, default 3),
+     EXTRACT_BREAKER_COOLDOWN_S (default 60),
+     EXTRACT_BREAKER_STATE (JSON path, default state/circuit_breakers.json next to this file).
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+USER_AGENT = "freightbite-pdf-extract"
+DEFAULT_BUDGET_S = 8.0
+DEFAULT_BREAKER_FAILURES = 3
+DEFAULT_BREAKER_COOLDOWN_S = 60.0
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _breaker_state_path() -> Path:
+    env = os.environ.get("EXTRACT_BREAKER_STATE")
+    if env:
+        return Path(env)
+    return Path(__file__).resolve().parent / "state" / "circuit_breakers.json"
+
+
+class Budget:
+    """Wall-clock budget for all lookups of one document, plus the counters recorded against it."""
+
+    def __init__(self, seconds: float | None = None):
+        if seconds is None:
+            seconds = _env_float("EXTRACT_ENRICH_BUDGET_S", DEFAULT_BUDGET_S)
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.stats = Counter()
+
+    def remaining(self) -> float:
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def count(self, service: str, outcome: str) -> None:
+        self.stats[f"{service}.{outcome}"] += 1
+
+    def summary(self) -> dict:
+        out = dict(sorted(self.stats.items()))
+        out["degraded"] = any(k.endswith((".failed", ".skipped_circuit_open", ".skipped_budget")) for k in self.stats)
+        return out
+
+
+class CircuitBreaker:
+    """Open after `failures` consecutive failures. Once `cooldown` has passed the breaker is half-open: exactly
+    one trial request is admitted (others stay skipped for `trial_timeout`); its outcome closes or re-opens it.
+    State is shared through the JSON file; every read-modify-write holds an exclusive file lock."""
+
+    def __init__(self, name: str, failures: int, cooldown: float, state_path: Path | None = None, trial_timeout: float = 10.0):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self.state_path = state_path
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        with self._locked():
+            self._load()
+
+    @contextmanager
+    def _locked(self):
+        if not self.state_path:
+            yield
+            return
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            lock = open(self.state_path.with_suffix(".lock"), "a+")
+        except OSError:
+            yield
+            return
+        try:
+            if os.name == "nt":
+                import msvcrt
+
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+        finally:
+            lock.close()
+
+    def _load(self) -> None:
+        if not self.state_path:
+            return
+        try:
+            state = json.loads(self.state_path.read_text()).get(self.name, {})
+        except (OSError, ValueError):
+            return
+        self.consecutive_failures = int(state.get("consecutive_failures", 0))
+        self.open_until = float(state.get("open_until", 0.0))
+
+    def _save(self) -> None:
+        # Caller holds _locked()
+        if not self.state_path:
+            return
+        try:
+            try:
+                state = json.loads(self.state_path.read_text())
+            except (OSError, ValueError):
+                state = {}
+            state[self.name] = {"consecutive_failures": self.consecutive_failures, "open_until": self.open_until}
+            tmp = self.state_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(state))
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+
+    def allow(self) -> bool:
+        with self._locked():
+            # Pick up a breaker opened, closed or put on trial by another extractor process
+            self._load()
+            now = time.time()
+            if now < self.open_until:
+                return False
+            if self.consecutive_failures >= self.failures:
+                # Half-open: this caller is the trial; hold everyone else off until it reports back (or times out)
+                self.open_until = now + self.trial_timeout
+                self._save()
+            return True
+
+    def record_success(self) -> None:
+        with self._locked():
+            self._load()
+            if self.consecutive_failures or self.open_until:
+                self.consecutive_failures = 0
+                self.open_until = 0.0
+                self._save()
+
+    def record_failure(self) -> None:
+        with self._locked():
+            self._load()
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failures:
+                self.open_until = time.time() + self.cooldown
+            self._save()
+
+
+class Service:
+    """One upstream: base URL, per-request timeout, minimum spacing between requests, breaker."""
+
+    def __init__(self, name: str, base_url: str, timeout: float, min_interval: float, breaker: CircuitBreaker):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.breaker = breaker
+        self._last_request = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self) -> float:
+        return max(self._last_request + self.min_interval - time.monotonic(), 0.0)
+
+
+class HttpClient:
+    def __init__(self, pool_size: int = 4):
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        failures = int(_env_float("EXTRACT_BREAKER_FAILURES", DEFAULT_BREAKER_FAILURES))
+        cooldown = _env_float("EXTRACT_BREAKER_COOLDOWN_S", DEFAULT_BREAKER_COOLDOWN_S)
+        state_path = _breaker_state_path()
+        self.services = {
+            # Nominatim usage policy: at most 1 request per second
+            "nominatim": Service(
+                "nominatim",
+                os.environ.get("NOMINATIM_BASE_URL", "https://nominatim.openstreetmap.org"),
+                timeout=5.0,
+                min_interval=1.0,
+                breaker=CircuitBreaker("nominatim", failures, cooldown, state_path, trial_timeout=5.0),
+            ),
+            "osrm": Service(
+                "osrm",
+                os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org"),
+                timeout=5.0,
+                min_interval=0.0,
+                breaker=CircuitBreaker("osrm", failures, cooldown, state_path, trial_timeout=5.0),
+            ),
+        }
+
+    def close(self) -> None:
+        self.session.close()
+
+    def get_json(self, service_name: str, path: str, params: dict | None = None, budget: Budget | None = None):
+        """GET base_url + path and decode JSON. Returns None (and counts why) when skipped or failed."""
+        service = self.services[service_name]
+        budget = budget or Budget()
+        if not service.breaker.allow():
+            budget.count(service_name, "skipped_circuit_open")
+            return None
+        with service._lock:
+            wait = service.wait_time()
+            # Not worth starting: rate-limit wait plus a minimal request would not fit in the budget
+            if wait + 0.5 > budget.remaining():
+                budget.count(service_name, "skipped_budget")
+                return None
+            if wait:
+                time.sleep(wait)
+            service._last_request = time.monotonic()
+        timeout = min(service.timeout, budget.remaining())
+        try:
+            resp = self.session.get(service.base_url + path, params=params, timeout=timeout)
+            if 400 <= resp.status_code < 500 and resp.status_code != 429:
+                # The service answered; the query itself was bad (e.g. OSRM NoRoute). Not a health problem.
+                service.breaker.record_success()
+                budget.count(service_name, "rejected")
+                return None
+            resp.raise_for_status()
+            data = resp.json()
+        except (requests.RequestException, ValueError):
+            service.breaker.record_failure()
+            budget.count(service_name, "failed")
+            return None
+        service.breaker.record_success()
+        budget.count(service_name, "ok")
+        return data
+
+
+_default_client = None
+
+
+def default_client() -> HttpClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = HttpClient()
+    return _default_client
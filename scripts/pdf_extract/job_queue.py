@@ -0,0 +1,250 @@
+"""
+Durable local job queue (SQLite) for extraction work.
+
+Jobs have a kind ("extract", "complete_ocr"), a JSON payload and a pool:
+"interactive" (driver uploads) or "backfill" (directory runs, background OCR).
+Interactive jobs always sort ahead of backfill; within a pool jobs run in
+priority then FIFO order.
+
+- claim() takes a lease (visibility timeout). A worker that crashes stops
+  renewing it; once the lease expires the job is retried with backoff, or
+  failed with "lease expired" when it has used all its attempts.
+- Each pool has a concurrency limit enforced across all worker processes by
+  counting live leases at claim time.
+- fail(transient=True) requeues with exponential backoff until max_attempts.
+- metrics() reports queue depth per pool/status and the oldest queued age.
+
+Env: EXTRACT_QUEUE_DB (SQLite path, default state/jobs.sqlite next to this file),
+     EXTRACT_POOL_LIMIT_INTERACTIVE / EXTRACT_POOL_LIMIT_BACKFILL (default 4 / 1).
+"""
+
+import json
+import os
+import random
+import sqlite3
+import time
+from pathlib import Path
+
+POOLS = ("interactive", "backfill")
+# Lower runs first: any interactive job jumps ahead of every backfill job
+POOL_PRIORITY = {"interactive": 0, "backfill": 100}
+DEFAULT_POOL_LIMITS = {"interactive": 4, "backfill": 1}
+DEFAULT_VISIBILITY_TIMEOUT_S = 300.0
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE_S = 5.0
+BACKOFF_MAX_S = 600.0
+# Error text that means "try again later" (Supabase/PostgREST or network hiccups), not a bad document
+TRANSIENT_MARKERS = (
+    "timeout",
+    "timed out",
+    "connection",
+    "temporarily",
+    "rate limit",
+    "too many requests",
+    "429",
+    "502",
+    "503",
+    "504",
+)
+
+
+def default_db_path() -> Path:
+    env = os.environ.get("EXTRACT_QUEUE_DB")
+    if env:
+        return Path(env)
+    return Path(__file__).resolve().parent / "state" / "jobs.sqlite"
+
+
+def pool_limit(pool: str) -> int:
+    try:
+        return int(os.environ.get(f"EXTRACT_POOL_LIMIT_{pool.upper()}", DEFAULT_POOL_LIMITS[pool]))
+    except ValueError:
+        return DEFAULT_POOL_LIMITS[pool]
+
+
+def is_transient_error(message: str | None) -> bool:
+    text = (message or "").lower()
+    return any(marker in text for marker in TRANSIENT_MARKERS)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with full jitter: up to BACKOFF_BASE_S * 2^(attempts-1), capped."""
+    return random.uniform(0, min(BACKOFF_BASE_S * 2 ** max(attempts - 1, 0), BACKOFF_MAX_S))
+
+
+class JobQueue:
+    """One connection per thread: open a JobQueue in each worker thread."""
+
+    def __init__(self, db_path: str | Path | None = None):
+        self.db_path = Path(db_path) if db_path else default_db_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode so claim() can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+              id INTEGER PRIMARY KEY AUTOINCREMENT,
+              kind TEXT NOT NULL,
+              payload TEXT NOT NULL,
+              pool TEXT NOT NULL CHECK (pool IN ('interactive','backfill')),
+              priority INTEGER NOT NULL,
+              status TEXT NOT NULL CHECK (status IN ('queued','running','done','failed')),
+              attempts INTEGER NOT NULL DEFAULT 0,
+              max_attempts INTEGER NOT NULL,
+              available_at REAL NOT NULL,
+              lease_until REAL,
+              worker TEXT,
+              result TEXT,
+              last_error TEXT,
+              created_at REAL NOT NULL,
+              updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority, id);
+            """
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def _row(self, row) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def enqueue(
+        self,
+        kind: str,
+        payload: dict,
+        pool: str = "interactive",
+        priority: int = 0,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ) -> int:
+        """Add a job; priority orders jobs within a pool (lower first)."""
+        if pool not in POOLS:
+            raise ValueError(f"pool must be one of {POOLS}")
+        now = time.time()
+        cur = self._conn.execute(
+            "INSERT INTO jobs (kind, payload, pool, priority, status, max_attempts, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)",
+            (kind, json.dumps(payload), pool, POOL_PRIORITY[pool] + priority, max_attempts, now, now, now),
+        )
+        return cur.lastrowid
+
+    def claim(self, worker: str, pools: tuple[str, ...] = POOLS, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT_S) -> dict | None:
+        """Lease the next runnable job from `pools` whose pool is under its concurrency limit, or None."""
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases belong to crashed/stuck workers: retry with backoff while attempts remain,
+            # so a document that kills its worker every time cannot hold a pool slot forever
+            expired = self._conn.execute(
+                "SELECT id, attempts, max_attempts FROM jobs WHERE status = 'running' AND lease_until < ?", (now,)
+            ).fetchall()
+            for job_id, attempts, max_attempts in expired:
+                if attempts >= max_attempts:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'failed', worker = NULL, lease_until = NULL, last_error = 'lease expired', "
+                        "updated_at = ? WHERE id = ?",
+                        (now, job_id),
+                    )
+                else:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'queued', worker = NULL, lease_until = NULL, available_at = ?, "
+                        "last_error = 'lease expired', updated_at = ? WHERE id = ?",
+                        (now + backoff_seconds(attempts), now, job_id),
+                    )
+            running = dict(
+                self._conn.execute("SELECT pool, COUNT(*) FROM jobs WHERE status = 'running' GROUP BY pool").fetchall()
+            )
+            open_pools = [p for p in pools if running.get(p, 0) < pool_limit(p)]
+            job = None
+            if open_pools:
+                marks = ",".join("?" * len(open_pools))
+                row = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE status = 'queued' AND available_at <= ? AND pool IN ({marks}) "
+                    "ORDER BY priority, id LIMIT 1",
+                    (now, *open_pools),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ?, updated_at = ? "
+                        "WHERE id = ?",
+                        (worker, now + visibility_timeout, now, row["id"]),
+                    )
+                    job = self.get(row["id"])
+            self._conn.execute("COMMIT")
+            return job
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    # heartbeat/complete/fail take the job dict returned by claim() and only touch the job while that claim
+    # still owns it (same worker and attempt, still running). They return False once the lease was lost,
+    # i.e. it expired and the job was re-claimed, requeued or failed in the meantime.
+    _OWNED = "id = ? AND status = 'running' AND worker = ? AND attempts = ?"
+
+    def _owned(self, job: dict) -> tuple:
+        return (job["id"], job["worker"], job["attempts"])
+
+    def heartbeat(self, job: dict, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT_S) -> bool:
+        now = time.time()
+        cur = self._conn.execute(
+            f"UPDATE jobs SET lease_until = ?, updated_at = ? WHERE {self._OWNED}",
+            (now + visibility_timeout, now, *self._owned(job)),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, job: dict, result: dict | None = None) -> bool:
+        cur = self._conn.execute(
+            f"UPDATE jobs SET status = 'done', result = ?, lease_until = NULL, updated_at = ? WHERE {self._OWNED}",
+            (json.dumps(result, ensure_ascii=False, default=str) if result is not None else None, time.time(), *self._owned(job)),
+        )
+        return cur.rowcount == 1
+
+    def fail(self, job: dict, error: str, transient: bool = False, result: dict | None = None) -> bool:
+        """Record a failure; transient failures are retried with backoff until max_attempts."""
+        now = time.time()
+        encoded = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+        if transient and job["attempts"] < job["max_attempts"]:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', available_at = ?, worker = NULL, lease_until = NULL, "
+                f"last_error = ?, result = ?, updated_at = ? WHERE {self._OWNED}",
+                (now + backoff_seconds(job["attempts"]), error, encoded, now, *self._owned(job)),
+            )
+        else:
+            cur = self._conn.execute(
+                f"UPDATE jobs SET status = 'failed', lease_until = NULL, last_error = ?, result = ?, updated_at = ? WHERE {self._OWNED}",
+                (error, encoded, now, *self._owned(job)),
+            )
+        return cur.rowcount == 1
+
+    def active_payloads(self, kind: str) -> list[dict]:
+        """Payloads of queued/running jobs of one kind (e.g. to tell which spooled files are still needed)."""
+        return [
+            json.loads(payload)
+            for (payload,) in self._conn.execute(
+                "SELECT payload FROM jobs WHERE kind = ? AND status IN ('queued', 'running')", (kind,)
+            )
+        ]
+
+    def get(self, job_id: int) -> dict | None:
+        return self._row(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def metrics(self) -> dict:
+        """Queue depth per pool and status, running vs limit, and age of the oldest runnable job per pool."""
+        now = time.time()
+        out = {}
+        for pool in POOLS:
+            out[pool] = {"queued": 0, "running": 0, "done": 0, "failed": 0, "limit": pool_limit(pool), "oldest_queued_s": None}
+        for pool, status, n in self._conn.execute("SELECT pool, status, COUNT(*) FROM jobs GROUP BY pool, status"):
+            out[pool][status] = n
+        for pool, oldest in self._conn.execute(
+            "SELECT pool, MIN(created_at) FROM jobs WHERE status = 'queued' GROUP BY pool"
+        ):
+            out[pool]["oldest_queued_s"] = round(now - oldest, 1)
+        return out
@@ -0,0 +1,311 @@
+"""
+Incrementally maintained lane-rate aggregates.
+
+Every rate written by extract_invoice.py is folded into a daily bucket keyed by
+(origin_state, destination_state, equipment_type, metric, day) holding count, sum,
+sum of squares, min/max and a mergeable log-bucket quantile sketch. A lane query
+merges at most one bucket per day of the window (x equipment types), so its cost
+depends on the window length, not on how many rates have been stored.
+
+Metrics: rate_per_mile ($/mile) and total_rate (base cost of the load).
+
+Usage:
+  python lane_aggregates.py NY OH --days 90
+  python lane_aggregates.py NY OH --equipment reefer --metric total_rate
+  python lane_aggregates.py --rebuild      # seed/recompute from the Supabase rates table
+
+Env: EXTRACT_LANE_DB (SQLite path, default state/lane_aggregates.sqlite next to this file).
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+METRICS = ("rate_per_mile", "total_rate")
+# Relative accuracy of quantiles from the sketch (1% -> p50 of $2.10/mi is within ~2 cents).
+SKETCH_ALPHA = 0.01
+_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+_LOG_GAMMA = math.log(_GAMMA)
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75, 0.9)
+
+
+def default_db_path() -> Path:
+    env = os.environ.get("EXTRACT_LANE_DB")
+    if env:
+        return Path(env)
+    return Path(__file__).resolve().parent / "state" / "lane_aggregates.sqlite"
+
+
+def _norm_state(s: str | None) -> str:
+    return ((s or "").strip().upper() or "XX")[:2]
+
+
+def _norm_equipment(s: str | None) -> str:
+    return (s or "").strip().lower()[:50]
+
+
+# --- Quantile sketch: log-spaced buckets, mergeable by adding counts ---
+def sketch_add(sketch: dict, value: float) -> None:
+    key = str(math.ceil(math.log(value) / _LOG_GAMMA))
+    sketch[key] = sketch.get(key, 0) + 1
+
+
+def sketch_merge(into: dict, other: dict) -> None:
+    for key, n in other.items():
+        into[key] = into.get(key, 0) + n
+
+
+def sketch_quantile(sketch: dict, q: float) -> float | None:
+    """Value at quantile q (0..1), within SKETCH_ALPHA relative error."""
+    total = sum(sketch.values())
+    if total == 0:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for key in sorted(sketch, key=int):
+        seen += sketch[key]
+        if seen > rank:
+            return 2 * _GAMMA ** int(key) / (_GAMMA + 1)
+    return None
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+def bucket_day(value: str | None, fallback: str | None = None) -> str | None:
+    """ISO day for a rate's bucket. A missing, unparsable or future date (e.g. a misread year) falls back to
+    `fallback` (None = processing date) so it cannot sit in every "last N days" window."""
+    try:
+        day = date.fromisoformat(str(value)[:10]).isoformat() if value else None
+    except ValueError:
+        day = None
+    return day if day and day <= _today() else fallback
+
+
+class LaneAggregates:
+    """SQLite-backed daily lane buckets; record() on the write path, lane_stats() to read."""
+
+    def __init__(self, db_path: str | Path | None = None):
+        self.db_path = Path(db_path) if db_path else default_db_path()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode so record() can take the write lock up front with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS lane_buckets (
+              origin_state TEXT NOT NULL,
+              destination_state TEXT NOT NULL,
+              equipment_type TEXT NOT NULL,
+              metric TEXT NOT NULL,
+              day TEXT NOT NULL,
+              count INTEGER NOT NULL,
+              sum REAL NOT NULL,
+              sum_sq REAL NOT NULL,
+              min REAL NOT NULL,
+              max REAL NOT NULL,
+              sketch TEXT NOT NULL,
+              PRIMARY KEY (origin_state, destination_state, metric, equipment_type, day)
+            );
+            """
+        )
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def record(
+        self,
+        origin_state: str | None,
+        destination_state: str | None,
+        equipment_type: str | None,
+        values: dict,
+        day: str | None = None,
+    ) -> None:
+        """Fold one rate into its lane/day bucket. values maps metric -> number; non-positive values are skipped."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._fold(origin_state, destination_state, equipment_type, values, day)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _fold(self, origin_state, destination_state, equipment_type, values: dict, day: str | None) -> None:
+        # Caller holds the write transaction
+        key = (_norm_state(origin_state), _norm_state(destination_state), _norm_equipment(equipment_type))
+        day = day or _today()
+        for metric in METRICS:
+            v = values.get(metric)
+            if v is None or v <= 0:
+                continue
+            v = float(v)
+            row = self._conn.execute(
+                "SELECT count, sum, sum_sq, min, max, sketch FROM lane_buckets "
+                "WHERE origin_state = ? AND destination_state = ? AND equipment_type = ? AND metric = ? AND day = ?",
+                (*key, metric, day),
+            ).fetchone()
+            if row:
+                count, total, total_sq, lo, hi, sketch = row[0], row[1], row[2], row[3], row[4], json.loads(row[5])
+            else:
+                count, total, total_sq, lo, hi, sketch = 0, 0.0, 0.0, v, v, {}
+            sketch_add(sketch, v)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO lane_buckets "
+                "(origin_state, destination_state, equipment_type, metric, day, count, sum, sum_sq, min, max, sketch) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (*key, metric, day, count + 1, total + v, total_sq + v * v, min(lo, v), max(hi, v), json.dumps(sketch)),
+            )
+
+    def record_extracted(self, extracted: dict, base_cost: float | None) -> None:
+        """Record the lane rate of one processed document (same fields the rates row is built from)."""
+        self.record(
+            extracted.get("origin_state"),
+            extracted.get("destination_state"),
+            extracted.get("equipment_type"),
+            {"rate_per_mile": extracted.get("rate_per_mile"), "total_rate": base_cost},
+            day=bucket_day(extracted.get("pickup_date") or extracted.get("invoice_date")),
+        )
+
+    def rebuild(self, rates) -> int:
+        """Replace all buckets with the given rates (iterable of dicts from fetch_rates()); returns rates folded.
+        Runs in one write transaction, so readers see either the old or the new aggregates."""
+        n = 0
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DELETE FROM lane_buckets")
+            for r in rates:
+                self._fold(r["origin_state"], r["destination_state"], r["equipment_type"], r["values"], r["day"])
+                n += 1
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return n
+
+    def lane_stats(
+        self,
+        origin_state: str,
+        destination_state: str,
+        equipment_type: str | None = None,
+        days: int = 90,
+        metric: str = "rate_per_mile",
+        quantiles: tuple[float, ...] = DEFAULT_QUANTILES,
+    ) -> dict:
+        """Count, mean, stddev, min/max and approximate quantiles for a lane over the last `days` days.
+        equipment_type=None merges all equipment types."""
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {METRICS}")
+        today = datetime.now(timezone.utc).date()
+        # `days` calendar days ending today, inclusive
+        since = (today - timedelta(days=days - 1)).isoformat()
+        sql = (
+            "SELECT count, sum, sum_sq, min, max, sketch FROM lane_buckets "
+            "WHERE origin_state = ? AND destination_state = ? AND metric = ? AND day >= ? AND day <= ?"
+        )
+        params = [_norm_state(origin_state), _norm_state(destination_state), metric, since, today.isoformat()]
+        if equipment_type is not None:
+            sql += " AND equipment_type = ?"
+            params.append(_norm_equipment(equipment_type))
+        count, total, total_sq, lo, hi, sketch = 0, 0.0, 0.0, None, None, {}
+        for c, s, sq, mn, mx, sk in self._conn.execute(sql, params):
+            count += c
+            total += s
+            total_sq += sq
+            lo = mn if lo is None else min(lo, mn)
+            hi = mx if hi is None else max(hi, mx)
+            sketch_merge(sketch, json.loads(sk))
+        out = {
+            "origin_state": params[0],
+            "destination_state": params[1],
+            "equipment_type": equipment_type,
+            "metric": metric,
+            "days": days,
+            "count": count,
+            "mean": None,
+            "stddev": None,
+            "min": round(lo, 2) if lo is not None else None,
+            "max": round(hi, 2) if hi is not None else None,
+            "quantiles": {},
+        }
+        if count:
+            mean = total / count
+            out["mean"] = round(mean, 2)
+            out["stddev"] = round(math.sqrt(max(total_sq / count - mean * mean, 0.0)), 2)
+            out["quantiles"] = {f"p{round(q * 100)}": round(sketch_quantile(sketch, q), 2) for q in quantiles}
+        return out
+
+
+# --- Seeding from the Supabase rates table ---
+def fetch_rates(sb, page_size: int = 1000):
+    """Yield every rates row as {origin_state, destination_state, equipment_type, values, day}, with the same
+    values and day record_extracted() would have used when the rate was inserted."""
+    start = 0
+    while True:
+        r = (
+            sb.table("rates")
+            .select(
+                "id, origin_state, destination_state, equipment_type, rate_type, rate_amount, metadata, created_at, "
+                "document:documents(pickup_date:metadata->extracted->>pickup_date, invoice_date:metadata->extracted->>invoice_date)"
+            )
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute()
+        )
+        rows = r.data or []
+        for row in rows:
+            metadata = row.get("metadata") or {}
+            document = row.get("document") or {}
+            per_mile = row.get("rate_type") == "per_mile"
+            yield {
+                "origin_state": row.get("origin_state"),
+                "destination_state": row.get("destination_state"),
+                "equipment_type": row.get("equipment_type"),
+                "values": {
+                    "rate_per_mile": row.get("rate_amount") if per_mile else None,
+                    "total_rate": metadata.get("total_rate") if per_mile else metadata.get("total_rate", row.get("rate_amount")),
+                },
+                "day": bucket_day(
+                    document.get("pickup_date") or document.get("invoice_date"),
+                    fallback=bucket_day(row.get("created_at")),
+                ),
+            }
+        if len(rows) < page_size:
+            return
+        start += page_size
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Query incrementally maintained lane-rate aggregates")
+    ap.add_argument("origin_state", nargs="?", help="Origin state, e.g. NY")
+    ap.add_argument("destination_state", nargs="?", help="Destination state, e.g. OH")
+    ap.add_argument("--equipment", default=None, help="Equipment type (default: all)")
+    ap.add_argument("--days", type=int, default=90, help="Window length in days")
+    ap.add_argument("--metric", default="rate_per_mile", choices=METRICS)
+    ap.add_argument("--rebuild", action="store_true", help="Recompute all buckets from the Supabase rates table")
+    args = ap.parse_args()
+
+    lanes = LaneAggregates()
+    if args.rebuild:
+        from extract_invoice import get_supabase
+
+        try:
+            print(f"Rebuilt lane aggregates from {lanes.rebuild(fetch_rates(get_supabase()))} rate(s).")
+        finally:
+            lanes.close()
+        return
+    if not (args.origin_state and args.destination_state):
+        lanes.close()
+        ap.error("origin_state and destination_state are required unless --rebuild is given")
+    try:
+        stats = lanes.lane_stats(args.origin_state, args.destination_state, args.equipment, days=args.days, metric=args.metric)
+    finally:
+        lanes.close()
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
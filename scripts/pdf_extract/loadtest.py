@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Load test for the upload -> extractor path.
+
+Replays PDFs (default: repo Invoices/) against extract_invoice.py the way the
+server.js outreach upload handler does: one Python process per upload, each
+with its own temp copy of the file. Supabase (PostgREST), Nominatim and OSRM are
+replaced by a local stub server so only the extractor itself is measured.
+
+Arrivals are open-loop: with --rate R uploads arrive as a Poisson process at R/s
+and wait for one of --concurrency worker slots; with --rate 0 the next upload
+starts as soon as a slot frees (closed loop). Reports throughput, latency
+percentiles (end-to-end including queueing, and service time), host CPU
+utilization, and per-worker CPU time and peak RSS (including Tesseract).
+
+Usage:
+  python loadtest.py --concurrency 20 --requests 60
+  python loadtest.py --concurrency 8 --rate 2 --requests 100 --stub-latency-ms 200 --json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+DEFAULT_PDF_DIR = SCRIPT_DIR.parents[1] / "Invoices"
+
+
+# --- Stub upstreams: PostgREST (Supabase), Nominatim, OSRM on one local port ---
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency_s = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, payload) -> None:
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self) -> None:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        if self.path.startswith("/search"):
+            # Nominatim: any address resolves to a point; jitter so OSRM gets distinct coordinates
+            self._reply(200, [{"lat": f"{40 + random.random():.5f}", "lon": f"{-80 + random.random():.5f}"}])
+        elif self.path.startswith("/route/"):
+            self._reply(200, {"code": "Ok", "routes": [{"distance": random.uniform(100_000, 1_500_000)}]})
+        elif self.path.startswith("/rest/v1/"):
+            # PostgREST: lookups find nothing (so inserts happen), writes echo a new id
+            if self.command == "GET":
+                self._reply(200, [])
+            else:
+                self._reply(201 if self.command == "POST" else 200, [{"id": str(uuid.uuid4())}])
+        else:
+            self._reply(404, {"error": "not stubbed"})
+
+    do_GET = do_POST = do_PATCH = _handle
+
+
+def start_stub_server(latency_s: float) -> ThreadingHTTPServer:
+    handler = type("StubHandler", (_StubHandler,), {"latency_s": latency_s})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# --- Host CPU sampling (Linux /proc/stat) ---
+def _cpu_times() -> tuple[int, int] | None:
+    try:
+        with open("/proc/stat") as f:
+            fields = [int(x) for x in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = fields[3] + (fields[4] if len(fields) > 4 else 0)
+    return sum(fields), idle
+
+
+class CpuSampler:
+    """Samples host CPU utilization every `interval` seconds; mean and peak over the run."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        prev = _cpu_times()
+        while prev and not self._stop.wait(self.interval):
+            cur = _cpu_times()
+            total, idle = cur[0] - prev[0], cur[1] - prev[1]
+            if total > 0:
+                self.samples.append(100.0 * (total - idle) / total)
+            prev = cur
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        if not self.samples:
+            return {"mean_pct": None, "peak_pct": None}
+        return {"mean_pct": round(statistics.fmean(self.samples), 1), "peak_pct": round(max(self.samples), 1)}
+
+
+# --- Workers ---
+def run_one(python: str, pdf: Path, env: dict, tmp_dir: Path, extra_args: list[str]) -> dict:
+    """Copy the PDF to a temp file (as server.js does), run the extractor, reap it with wait4 for rusage."""
+    tmp_pdf = tmp_dir / f"{uuid.uuid4().hex[:8]}-{pdf.name}"
+    shutil.copyfile(pdf, tmp_pdf)
+    cmd = [python, str(SCRIPT_DIR / "extract_invoice.py"), str(tmp_pdf), "--json-output", *extra_args]
+    started = time.monotonic()
+    try:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Drain pipes in threads so a chatty child cannot block; wait4 gives CPU time and peak RSS
+        # of the child including its reaped descendants (tesseract).
+        out = {}
+        readers = [
+            threading.Thread(target=lambda: out.__setitem__("stdout", proc.stdout.read())),
+            threading.Thread(target=lambda: out.__setitem__("stderr", proc.stderr.read())),
+        ]
+        for t in readers:
+            t.start()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        for t in readers:
+            t.join()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    finally:
+        tmp_pdf.unlink(missing_ok=True)
+    elapsed = time.monotonic() - started
+    error = None
+    if proc.returncode != 0:
+        error = (out.get("stderr") or b"").decode(errors="replace").strip().splitlines()[-1:] or [f"exit {proc.returncode}"]
+        error = error[0]
+    else:
+        # Like server.js tryParseJsonFromStdout: the payload is the last JSON line (libraries may print before it)
+        lines = [ln for ln in (out.get("stdout") or b"").decode(errors="replace").splitlines() if ln.startswith("{")]
+        try:
+            result = json.loads(lines[-1])["results"][0]
+            error = result.get("error")
+        except (ValueError, KeyError, IndexError):
+            error = "no structured result"
+    return {
+        "filename": pdf.name,
+        "service_s": elapsed,
+        "cpu_s": rusage.ru_utime + rusage.ru_stime,
+        "max_rss_mb": rusage.ru_maxrss / 1024.0,  # KiB on Linux
+        "error": error,
+    }
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def _summary(values: list[float]) -> dict:
+    return {
+        "p50": round(percentile(values, 0.50), 3) if values else None,
+        "p95": round(percentile(values, 0.95), 3) if values else None,
+        "p99": round(percentile(values, 0.99), 3) if values else None,
+        "max": round(max(values), 3) if values else None,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent load test for extract_invoice.py with stubbed upstreams")
+    ap.add_argument("--pdfs", default=str(DEFAULT_PDF_DIR), help="PDF file or directory to replay")
+    ap.add_argument("--concurrency", type=int, default=4, help="Max extractor processes running at once")
+    ap.add_argument("--rate", type=float, default=0.0, help="Mean arrivals per second (Poisson); 0 = closed loop")
+    ap.add_argument("--requests", type=int, default=20, help="Total uploads to replay (PDFs are cycled)")
+    ap.add_argument("--stub-latency-ms", type=float, default=50.0, help="Added latency of every stubbed upstream call")
+    ap.add_argument("--python", default=sys.executable, help="Interpreter for the extractor (e.g. scripts/pdf_extract/venv/bin/python)")
+    ap.add_argument("--use-llm", action="store_true", help="Pass --use-llm through (real LLM calls, not stubbed)")
+    ap.add_argument("--incremental-ocr", action="store_true", help="Run the extractor with --incremental-ocr (skipped pages are spooled to the temp dir)")
+    ap.add_argument("--seed", type=int, default=None, help="Random seed for arrival times")
+    ap.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = ap.parse_args()
+
+    pdf_path = Path(args.pdfs)
+    pdfs = [pdf_path] if pdf_path.is_file() else sorted(pdf_path.glob("*.pdf"))
+    if not pdfs:
+        print("No PDFs found:", pdf_path, file=sys.stderr)
+        sys.exit(1)
+    rng = random.Random(args.seed)
+
+    stub = start_stub_server(args.stub_latency_ms / 1000.0)
+    stub_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    work_dir = Path(tempfile.mkdtemp(prefix="freightbite-loadtest-"))
+    env = {
+        **os.environ,
+        "SUPABASE_URL": stub_url,
+        "SUPABASE_SERVICE_ROLE_KEY": "stub.stub.stub",
+        "NOMINATIM_BASE_URL": stub_url,
+        "OSRM_BASE_URL": stub_url,
+        # Isolated local state so runs neither dedupe against nor pollute real indexes
+        # (values set here win over .env.local: load_dotenv does not override the environment)
+        "EXTRACT_DEDUP": "0",
+        "EXTRACT_DEDUP_DB": str(work_dir / "dedup_index.sqlite"),
+        "EXTRACT_LANE_DB": str(work_dir / "lane_aggregates.sqlite"),
+        "EXTRACT_BREAKER_STATE": str(work_dir / "circuit_breakers.json"),
+        "EXTRACT_OCR_SPOOL": str(work_dir / "ocr_pending"),
+        "EXTRACT_QUEUE_DB": str(work_dir / "jobs.sqlite"),
+        "EXTRACT_QUEUE_FILES": str(work_dir / "queue_files"),
+        "EXTRACT_INCREMENTAL_OCR": "1" if args.incremental_ocr else "0",
+        "EXTRACT_USE_LLM": "1" if args.use_llm else "0",
+    }
+    extra_args = ["--use-llm"] if args.use_llm else []
+
+    slots = threading.Semaphore(args.concurrency)
+    lock = threading.Lock()
+    records = []
+    threads = []
+
+    def job(pdf: Path, arrived: float, holds_slot: bool) -> None:
+        if not holds_slot:
+            slots.acquire()
+        try:
+            queued = time.monotonic() - arrived
+            rec = run_one(args.python, pdf, env, work_dir, extra_args)
+        finally:
+            slots.release()
+        rec["queue_s"] = queued
+        rec["latency_s"] = time.monotonic() - arrived
+        with lock:
+            records.append(rec)
+
+    cpu = CpuSampler()
+    cpu.start()
+    started = time.monotonic()
+    try:
+        for i in range(args.requests):
+            closed_loop = args.rate <= 0
+            if closed_loop:
+                # Admit the next upload only when a slot frees
+                slots.acquire()
+            else:
+                time.sleep(rng.expovariate(args.rate))
+            t = threading.Thread(target=job, args=(pdfs[i % len(pdfs)], time.monotonic(), closed_loop))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+    finally:
+        wall = time.monotonic() - started
+        host_cpu = cpu.stop()
+        stub.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    ok = [r for r in records if not r["error"]]
+    errors = {}
+    for r in records:
+        if r["error"]:
+            errors[r["error"]] = errors.get(r["error"], 0) + 1
+    worker_cpu = [r["cpu_s"] for r in records]
+    report = {
+        "config": {
+            "pdfs": len(pdfs),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "rate_per_s": args.rate,
+            "stub_latency_ms": args.stub_latency_ms,
+            "cpus": os.cpu_count(),
+        },
+        "wall_s": round(wall, 2),
+        "completed": len(records),
+        "succeeded": len(ok),
+        "errors": errors,
+        "throughput_per_s": round(len(ok) / wall, 3) if wall > 0 else None,
+        "latency_s": _summary([r["latency_s"] for r in records]),
+        "service_s": _summary([r["service_s"] for r in records]),
+        "queue_s": _summary([r["queue_s"] for r in records]),
+        "host_cpu": host_cpu,
+        # Worker CPU time / (wall * cores): 100% means the extractors alone saturated the host
+        "worker_cpu_saturation_pct": round(100.0 * sum(worker_cpu) / (wall * (os.cpu_count() or 1)), 1) if wall > 0 else None,
+        "worker_cpu_s": _summary(worker_cpu),
+        "worker_peak_rss_mb": _summary([r["max_rss_mb"] for r in records]),
+    }
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False))
+        return
+    c = report["config"]
+    print(f"{report['completed']} uploads ({report['succeeded']} ok) in {report['wall_s']}s, "
+          f"concurrency {c['concurrency']}, rate {c['rate_per_s'] or 'closed loop'}, {c['cpus']} CPUs")
+    print(f"  Throughput:     {report['throughput_per_s']} docs/s")
+    for key, label in (("latency_s", "Latency"), ("service_s", "Service time"), ("queue_s", "Queue wait")):
+        s = report[key]
+        print(f"  {label + ':':<15} p50 {s['p50']}s  p95 {s['p95']}s  p99 {s['p99']}s  max {s['max']}s")
+    print(f"  Host CPU:       mean {host_cpu['mean_pct']}%  peak {host_cpu['peak_pct']}%  "
+          f"(extractors: {report['worker_cpu_saturation_pct']}% of all cores)")
+    s = report["worker_peak_rss_mb"]
+    print(f"  Worker RSS:     p50 {s['p50']}MB  p95 {s['p95']}MB  max {s['max']}MB")
+    for err, n in errors.items():
+        print(f"  Error x{n}: {err}")
+
+
+if __name__ == "__main__":
+    main()